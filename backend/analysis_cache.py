@@ -0,0 +1,282 @@
+import json
+import os
+import time
+
+from database import (SessionLocal, Video, AnalysisRun, Scene, ObjectDetection, ObjectInterval, EmotionSample,
+                      get_or_create_video)
+from frame_source import Analyzer, FrameSource
+from metrics import DB_WRITE_SECONDS
+
+
+def video_fingerprint(video_path):
+    """Cheap identity of the file contents: absolute path, size and mtime"""
+    stat = os.stat(video_path)
+    return f"{os.path.abspath(video_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _scene_row(run_id, event):
+    return {
+        "run_id": run_id,
+        "scene_index": event["id"],
+        "start_time": event["start"],
+        "end_time": event["end"],
+        "duration": event["duration"],
+        "confidence": event.get("confidence"),
+    }
+
+def _scene_event(row):
+    event = {
+        "type": "scene",
+        "id": row.scene_index,
+        "start": row.start_time,
+        "end": row.end_time,
+        "duration": row.duration
+    }
+    if row.confidence is not None:
+        event["confidence"] = row.confidence
+    return row.end_time, event
+
+def _object_row(run_id, event):
+    return {"run_id": run_id, "time": event["time"], "objects": json.dumps(event["objects"])}
+
+def _object_event(row):
+    return row.time, {"type": "object", "time": row.time, "objects": json.loads(row.objects)}
+
+def _interval_row(run_id, event):
+    return {
+        "run_id": run_id,
+        "track_id": event["track"],
+        "label": event["label"],
+        "start_time": event["start"],
+        "end_time": event["end"],
+        "samples": event["samples"],
+        "confidence": event["confidence"],
+    }
+
+def _interval_event(row):
+    return row.end_time, {
+        "type": "object_interval",
+        "track": row.track_id,
+        "label": row.label,
+        "start": row.start_time,
+        "end": row.end_time,
+        "samples": row.samples,
+        "confidence": row.confidence
+    }
+
+def _emotion_row(run_id, event):
+    return {"run_id": run_id, "time": event["time"], "emotions": json.dumps(event["emotions"])}
+
+def _emotion_event(row):
+    return row.time, {"type": "emotion", "time": row.time, "emotions": json.loads(row.emotions)}
+
+# analyzer name -> (table, event type, event -> row, row -> (time, event))
+RESULT_TABLES = {
+    "scenes": (Scene, "scene", _scene_row, _scene_event),
+    "objects": (ObjectDetection, "object", _object_row, _object_event),
+    "object_intervals": (ObjectInterval, "object_interval", _interval_row, _interval_event),
+    "emotions": (EmotionSample, "emotion", _emotion_row, _emotion_event),
+}
+
+
+def _params_key(analyzer):
+    return json.dumps(analyzer.cache_params(), sort_keys=True)
+
+def _delete_runs(session, runs):
+    for run in runs:
+        table = RESULT_TABLES[run.analyzer][0]
+        session.query(table).filter(table.run_id == run.id).delete()
+        session.delete(run)
+
+def load_cached_events(video_path, analyzer):
+    """Return the cached (time, event) list for this analyzer, or None on a miss.
+
+    Runs recorded against an older version of the file are deleted here.
+    """
+    if analyzer.name not in RESULT_TABLES or analyzer.cache_params() is None:
+        return None
+    fingerprint = video_fingerprint(video_path)
+    table, _, _, to_event = RESULT_TABLES[analyzer.name]
+
+    session = SessionLocal()
+    try:
+        video = get_or_create_video(session, video_path)
+        stale = session.query(AnalysisRun).filter(
+            AnalysisRun.video_id == video.id,
+            AnalysisRun.fingerprint != fingerprint
+        ).all()
+        if stale:
+            _delete_runs(session, stale)
+            session.commit()
+
+        run = session.query(AnalysisRun).filter(
+            AnalysisRun.video_id == video.id,
+            AnalysisRun.analyzer == analyzer.name,
+            AnalysisRun.params == _params_key(analyzer)
+        ).first()
+        if run is None:
+            return None
+
+        rows = session.query(table).filter(table.run_id == run.id).order_by(table.id).all()
+        events = [to_event(row) for row in rows]
+        summary = json.loads(run.summary)
+        events.append((summary.pop("time"), summary))
+        return events
+    finally:
+        session.close()
+
+def load_latest_events(video_path, analyzer_name):
+    """Events of the most recent cached run of an analyzer for this version of the file, whatever its parameters"""
+    if not os.path.exists(video_path):
+        return None
+    table, _, _, to_event = RESULT_TABLES[analyzer_name]
+    session = SessionLocal()
+    try:
+        run = (session.query(AnalysisRun).join(Video)
+               .filter(Video.path == video_path,
+                       AnalysisRun.analyzer == analyzer_name,
+                       AnalysisRun.fingerprint == video_fingerprint(video_path))
+               .order_by(AnalysisRun.created_at.desc()).first())
+        if run is None:
+            return None
+        rows = session.query(table).filter(table.run_id == run.id).order_by(table.id).all()
+        return [event for _, event in (to_event(row) for row in rows)]
+    finally:
+        session.close()
+
+def find_object_intervals(video_path, label=None):
+    """Intervals of the latest object tracking run for this version of the file, optionally one label.
+
+    None if the video has not been tracked.
+    """
+    if not os.path.exists(video_path):
+        return None
+    session = SessionLocal()
+    try:
+        run = (session.query(AnalysisRun).join(Video)
+               .filter(Video.path == video_path,
+                       AnalysisRun.analyzer == "object_intervals",
+                       AnalysisRun.fingerprint == video_fingerprint(video_path))
+               .order_by(AnalysisRun.created_at.desc()).first())
+        if run is None:
+            return None
+        query = session.query(ObjectInterval).filter(ObjectInterval.run_id == run.id)
+        if label is not None:
+            query = query.filter(ObjectInterval.label == label)
+        rows = query.order_by(ObjectInterval.start_time).all()
+        return [{"track": row.track_id, "label": row.label, "start": row.start_time, "end": row.end_time,
+                 "samples": row.samples, "confidence": row.confidence} for row in rows]
+    finally:
+        session.close()
+
+def store_events(video_path, analyzer, fingerprint, events):
+    """Persist the events of a completed run, replacing any previous run with the same parameters"""
+    table, event_type, to_row, _ = RESULT_TABLES[analyzer.name]
+    params = _params_key(analyzer)
+
+    started = time.perf_counter()
+    session = SessionLocal()
+    try:
+        video = get_or_create_video(session, video_path)
+        _delete_runs(session, session.query(AnalysisRun).filter(
+            AnalysisRun.video_id == video.id,
+            AnalysisRun.analyzer == analyzer.name,
+            AnalysisRun.params == params
+        ).all())
+
+        summary = {}
+        for event_time, event in events:
+            if event.get("type") == "done":
+                summary = dict(event, time=event_time)
+        run = AnalysisRun(video_id=video.id, analyzer=analyzer.name, params=params,
+                          fingerprint=fingerprint, summary=json.dumps(summary), created_at=time.time())
+        session.add(run)
+        session.flush()
+
+        rows = [to_row(run.id, event) for _, event in events if event.get("type") == event_type]
+        if rows:
+            session.execute(table.__table__.insert(), rows)
+        session.commit()
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started, table.__tablename__)
+    except Exception as e:
+        session.rollback()
+        print(f"[AnalysisCache] Could not store {analyzer.name} results: {e}")
+    finally:
+        session.close()
+
+
+class RecordingAnalyzer(Analyzer):
+    """Wraps a live analyzer and stores its events once the run completes.
+
+    A run in which inference batches failed is streamed but not stored, so
+    the next request runs the analysis again.
+    """
+
+    def __init__(self, inner, video_path):
+        self.inner = inner
+        self.name = inner.name
+        self.gate = inner.gate
+        self.video_path = video_path
+        self.fingerprint = video_fingerprint(video_path)
+        self.events = []
+
+    def start(self, fps, total_frames):
+        self.inner.video_path = self.video_path
+        return self.inner.start(fps, total_frames)
+
+    def frame_interval(self, fps):
+        return self.inner.frame_interval(fps)
+
+    def process(self, frame, frame_index):
+        events = self.inner.process(frame, frame_index)
+        self.events.extend(events)
+        return events
+
+    def pending_time(self):
+        return self.inner.pending_time()
+
+    def cancel(self):
+        self.inner.cancel()
+
+    def finish(self, frame_count):
+        events = self.inner.finish(frame_count)
+        self.events.extend(events)
+        if self.inner.failed_batches:
+            print(f"[AnalysisCache] Not storing {self.name} results: "
+                  f"{self.inner.failed_batches} inference batches failed")
+        else:
+            store_events(self.video_path, self.inner, self.fingerprint, self.events)
+        return events
+
+
+def run_analysis(video_path, analyzers, use_cache=True, should_stop=None):
+    """Run analyzers over a video, replaying any whose results are already cached.
+
+    When every analyzer hits the cache the video is not opened at all.
+    should_stop is polled once per sampled frame to cancel the run.
+    """
+    if not use_cache or not os.path.exists(video_path):
+        source = FrameSource(video_path)
+        for analyzer in analyzers:
+            source.register(analyzer)
+        yield from source.run(should_stop)
+        return
+
+    replayed = []
+    source = FrameSource(video_path)
+    for analyzer in analyzers:
+        cached = load_cached_events(video_path, analyzer)
+        if cached is not None:
+            replayed.extend(cached)
+        elif analyzer.name in RESULT_TABLES and analyzer.cache_params() is not None:
+            source.register(RecordingAnalyzer(analyzer, video_path))
+        else:
+            source.register(analyzer)
+
+    if not source.analyzers:
+        for _, event in sorted(replayed, key=lambda item: item[0]):
+            yield json.dumps(event)
+        return
+
+    source.replay(replayed)
+    yield from source.run(should_stop)
@@ -0,0 +1,366 @@
+"""Offline benchmark of the streaming analyzers.
+
+Generates a synthetic clip (hard cuts, static shots, moving content and a
+speech-like tone track), then runs detect_scenes_streaming,
+detect_objects_streaming, detect_emotions_streaming and
+transcribe_video_streaming over it, each in a fresh process, and reports:
+
+- throughput: seconds of video processed per second of wall time
+- time to first event: until the first scene/object/emotion/segment
+- peak RSS of the benchmark process
+
+With --models stub (the default) the detectors use small deterministic
+stand-ins installed through the modules' lazy model globals, so the run
+needs no downloaded weights and measures decode, sampling, batching,
+event merging and serialization. Those globals only exist in the benchmark
+process, so stub runs keep inference in-process (no inference workers).
+--models real uses whatever models are installed.
+
+Usage:
+    python benchmarks/bench_analyzers.py [--video path] [--seconds 60]
+        [--models stub|real] [--repeat 3] [--output results.json] [--baseline old.json]
+
+Results are written as JSON so runs from different releases can be compared
+with --baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+BENCHMARKS = ("scenes", "objects", "emotions", "transcription")
+FIRST_EVENT_TYPES = {"scene", "object", "emotion", "segment"}
+SAMPLE_RATE = 16000
+RESULT_VERSION = 1
+
+
+# ---------- SYNTHETIC INPUT ----------
+
+def _write_speech_like_wav(path, seconds):
+    """Voiced bursts with a wandering pitch and syllable-rate envelope, separated by pauses"""
+    rng = np.random.default_rng(0)
+    audio = np.zeros(int(seconds * SAMPLE_RATE), np.float32)
+    t = 0.0
+    while t < seconds:
+        burst = rng.uniform(1.0, 4.0)
+        start, end = int(t * SAMPLE_RATE), min(len(audio), int((t + burst) * SAMPLE_RATE))
+        n = np.arange(end - start) / SAMPLE_RATE
+        pitch = 120 + 40 * np.sin(2 * np.pi * 0.7 * n)
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * 4 * n))  # ~4 syllables per second
+        audio[start:end] = 0.3 * voiced * envelope
+        t += burst + rng.uniform(0.3, 1.5)
+    audio += rng.normal(0, 0.002, len(audio)).astype(np.float32)
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(SAMPLE_RATE)
+        out.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def make_synthetic_video(path, seconds=60, fps=30, size=(640, 360)):
+    """Alternate static shots and moving shots, with a hard cut every 5 seconds"""
+    from transcription import setup_ffmpeg
+
+    silent_path = path + '.video.mp4'
+    wav_path = path + '.wav'
+    writer = cv2.VideoWriter(silent_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    rng = np.random.default_rng(0)
+    shot = None
+    for i in range(seconds * fps):
+        if i % (fps * 5) == 0:
+            # Hard cut to a new textured background
+            shot = cv2.resize(rng.integers(0, 255, (9, 16, 3), dtype=np.uint8), size,
+                              interpolation=cv2.INTER_LINEAR)
+        frame = shot.copy()
+        if (i // (fps * 5)) % 2:
+            # Moving shot; the even shots stay static
+            cv2.circle(frame, ((i * 6) % size[0], size[1] // 2), 40, (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+
+    _write_speech_like_wav(wav_path, seconds)
+    if not setup_ffmpeg():
+        raise RuntimeError("FFmpeg is required to add the audio track")
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-i', silent_path, '-i', wav_path,
+                    '-c:v', 'copy', '-c:a', 'aac', '-shortest', path], check=True)
+    os.remove(silent_path)
+    os.remove(wav_path)
+    return path
+
+
+# ---------- STUB MODELS ----------
+
+class _Tensor:
+    """Just enough of a torch tensor for predict_batch: .cpu().numpy()"""
+
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class _Boxes:
+    def __init__(self, cls, conf, xyxy):
+        self.cls, self.conf, self.xyxy = _Tensor(cls), _Tensor(conf), _Tensor(xyxy)
+
+
+class _Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class StubYOLO:
+    """Letterboxes frames like YOLO and 'detects' the brightest grid cells"""
+    names = {0: "person", 1: "car", 2: "dog", 3: "chair"}
+
+    def __call__(self, frames, verbose=False):
+        results = []
+        for frame in frames:
+            small = cv2.resize(frame, (640, 640), interpolation=cv2.INTER_LINEAR)
+            cells = cv2.resize(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (4, 4), interpolation=cv2.INTER_AREA)
+            bright = np.flatnonzero(cells.ravel() > 160)
+            cls = (bright % len(self.names)).astype(np.float32)
+            conf = (cells.ravel()[bright] / 255.0).astype(np.float32)
+            xyxy = np.array([[(b % 4) * 160, (b // 4) * 160, (b % 4 + 1) * 160, (b // 4 + 1) * 160]
+                             for b in bright], np.float32).reshape(-1, 4)
+            results.append(_Result(_Boxes(cls, conf, xyxy)))
+        return results
+
+
+class StubDeepFace:
+    """Treats the frame centre as one face, like DeepFace without enforce_detection,
+    and picks an emotion from its 48x48 grayscale crop"""
+    emotions = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+
+    def analyze(self, frame, actions=None, enforce_detection=False, silent=True):
+        height, width = frame.shape[:2]
+        crop = frame[height // 4:height * 3 // 4, width // 4:width * 3 // 4]
+        face = cv2.resize(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), (48, 48), interpolation=cv2.INTER_AREA)
+        return [{"dominant_emotion": self.emotions[int(face.mean()) % len(self.emotions)]}]
+
+
+class StubEmotionModel:
+    """Batched stand-in for the Keras emotion classifier: scores from crop brightness"""
+
+    def predict(self, batch, verbose=0):
+        means = batch.reshape(len(batch), -1).mean(axis=1)
+        centers = np.linspace(0, 1, 7)
+        return np.exp(-((means[:, None] - centers[None, :]) ** 2) * 50)
+
+
+class StubWhisper:
+    """Emits one segment per voiced stretch, found with the energy VAD"""
+
+    def transcribe(self, audio, **kwargs):
+        from vad import frame_energy_db, _runs
+        frame_length = int(0.03 * SAMPLE_RATE)
+        voiced = frame_energy_db(audio, frame_length) > -35
+        segments = [{"start": start * 0.03, "end": end * 0.03, "text": f" segment {i}"}
+                    for i, (start, end) in enumerate(_runs(voiced))]
+        return {"text": "".join(s["text"] for s in segments), "segments": segments}
+
+
+def install_stub_models():
+    import emotion_recognition
+    import object_detection
+    import scene_detection
+    import transcription
+
+    object_detection._model = StubYOLO()
+    emotion_recognition._deepface = StubDeepFace()
+    emotion_recognition._emotion_model = StubEmotionModel()
+    transcription._model = StubWhisper()
+    if scene_detection.DEEP_LEARNING_AVAILABLE:
+        import torch
+        # Pooled colour layout stands in for ResNet features; same tensor path, no weights
+        scene_detection._feature_extractor = torch.nn.AdaptiveAvgPool2d(4).eval()
+
+
+# ---------- MEASUREMENT ----------
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+def _stream(name, video_path):
+    if name == "scenes":
+        from scene_detection import detect_scenes_streaming
+        return detect_scenes_streaming(video_path, use_cache=False)
+    if name == "objects":
+        from object_detection import detect_objects_streaming
+        return detect_objects_streaming(video_path, use_cache=False)
+    if name == "emotions":
+        from emotion_recognition import detect_emotions_streaming
+        return detect_emotions_streaming(video_path, use_cache=False)
+    from transcription import transcribe_video_streaming
+    return transcribe_video_streaming(video_path, workers=1)
+
+
+def video_duration(video_path):
+    from transcription import get_video_duration
+    duration = get_video_duration(video_path)
+    if duration is None:
+        # No ffprobe: fall back to the container's frame count
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        cap.release()
+        duration = frames / fps if fps > 0 else None
+    return duration
+
+
+def run_one(name, video_path, models):
+    """Runs in the child process; returns one result dict"""
+    if models == "stub":
+        install_stub_models()
+    duration = video_duration(video_path)
+    events = 0
+    first_event = None
+    errors = []
+    started = time.perf_counter()
+    for data in _stream(name, video_path):
+        event = json.loads(data)
+        if event.get("type") in FIRST_EVENT_TYPES:
+            events += 1
+            if first_event is None:
+                first_event = time.perf_counter() - started
+        elif event.get("type") == "error" or ("error" in event and "type" not in event):
+            errors.append(event["error"])
+    wall = time.perf_counter() - started
+    return {
+        "benchmark": name,
+        "wall_seconds": round(wall, 3),
+        "video_seconds": duration,
+        "realtime_factor": round(duration / wall, 2) if duration and wall > 0 else None,
+        "events": events,
+        "time_to_first_event": round(first_event, 3) if first_event is not None else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": errors
+    }
+
+
+def run_isolated(name, video_path, models):
+    """Run one benchmark in a fresh interpreter so peak RSS and model state are its own"""
+    workdir = tempfile.mkdtemp(prefix='neuralplay-bench-')  # keeps neuralplay.db out of the tree
+    env = dict(os.environ)
+    if models == 'stub':
+        env['NEURALPLAY_INFERENCE_WORKERS'] = '0'
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name,
+                             '--video', video_path, '--models', models],
+                            cwd=workdir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{name} benchmark failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _median_result(runs):
+    result = dict(runs[-1])
+    for key in ("wall_seconds", "realtime_factor", "time_to_first_event", "peak_rss_mb"):
+        values = [run[key] for run in runs if run[key] is not None]
+        result[key] = round(statistics.median(values), 3) if values else None
+    result["repeats"] = len(runs)
+    return result
+
+
+def _compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r["benchmark"]: r for r in json.load(f)["results"]}
+    print(f"\n{'vs baseline':<14} {'wall':>9} {'first ev':>9} {'rss':>9}")
+    for result in results:
+        old = baseline.get(result["benchmark"])
+        if old is None:
+            continue
+        deltas = []
+        for key in ("wall_seconds", "time_to_first_event", "peak_rss_mb"):
+            if result[key] is None or not old.get(key):
+                deltas.append(f"{'n/a':>9}")
+            else:
+                deltas.append(f"{(result[key] / old[key] - 1) * 100:>+8.1f}%")
+        print(f"{result['benchmark']:<14} {' '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='Benchmark this file instead of a synthetic clip')
+    parser.add_argument('--seconds', type=int, default=60, help='Length of the synthetic clip')
+    parser.add_argument('--models', choices=('stub', 'real'), default='stub')
+    parser.add_argument('--only', action='append', choices=BENCHMARKS, help='Run only these (repeatable)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per benchmark; the median is reported')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--baseline', help='Compare against a previous --output file')
+    parser.add_argument('--child', choices=BENCHMARKS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args.child, args.video, args.models)))
+        return
+
+    video_path = args.video
+    if video_path is None:
+        video_path = os.path.join(tempfile.gettempdir(), f'neuralplay_bench_analyzers_{args.seconds}s.mp4')
+        if not os.path.exists(video_path):
+            print(f"Generating synthetic video at {video_path}...")
+            make_synthetic_video(video_path, args.seconds)
+
+    results = []
+    print(f"{'benchmark':<14} {'wall s':>8} {'x realtime':>10} {'events':>7} {'first ev s':>10} {'peak MB':>8}")
+    for name in args.only or BENCHMARKS:
+        result = _median_result([run_isolated(name, video_path, args.models) for _ in range(args.repeat)])
+        results.append(result)
+        print(f"{name:<14} {result['wall_seconds']:>8.2f} {result['realtime_factor'] or 0:>10.1f} "
+              f"{result['events']:>7} {result['time_to_first_event'] or 0:>10.3f} {result['peak_rss_mb'] or 0:>8.1f}")
+        for error in result["errors"]:
+            print(f"  error: {error}")
+
+    report = {
+        "version": RESULT_VERSION,
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "models": args.models,
+        "video": {"path": video_path, "synthetic": args.video is None, "size_bytes": os.path.getsize(video_path)},
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count()
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        _compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark frame sampling strategies.
+
+Reports how many sampled frames per second of wall time each strategy in
+frame_source.FrameSampler delivers for a given sample interval.
+
+Usage:
+    python benchmarks/bench_sampling.py [video_path] [--interval 2.0] [--interval 0.5]
+
+Without a video path a synthetic 2-minute clip is generated with cv2.VideoWriter.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from frame_source import FrameSampler, SAMPLING_STRATEGIES
+
+
+def make_synthetic_video(path, seconds=120, fps=30, size=(640, 360)):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    rng = np.random.default_rng(0)
+    frame = np.zeros((size[1], size[0], 3), np.uint8)
+    for i in range(seconds * fps):
+        if i % (fps * 5) == 0:
+            frame[:] = rng.integers(0, 255, 3)
+        moving = frame.copy()
+        cv2.circle(moving, ((i * 4) % size[0], size[1] // 2), 30, (255, 255, 255), -1)
+        writer.write(moving)
+    writer.release()
+    return path
+
+
+def run_strategy(video_path, strategy, interval_seconds):
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    step = max(1, int(fps * interval_seconds))
+    sampler = FrameSampler(video_path, cap, fps, total_frames, [step], strategy)
+
+    frames = 0
+    started = time.perf_counter()
+    for _, frame in sampler.frames():
+        # Touch the pixels so lazy strategies pay for the full frame
+        frame.mean()
+        frames += 1
+    elapsed = time.perf_counter() - started
+    cap.release()
+    return sampler.strategy, frames, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video_path', nargs='?')
+    parser.add_argument('--interval', type=float, action='append',
+                        help='Sample interval in seconds (repeatable, default 0.5 and 2.0)')
+    args = parser.parse_args()
+
+    video_path = args.video_path
+    if video_path is None:
+        video_path = os.path.join(tempfile.gettempdir(), 'neuralplay_bench_sampling.mp4')
+        if not os.path.exists(video_path):
+            print(f"Generating synthetic video at {video_path}...")
+            make_synthetic_video(video_path)
+
+    print(f"{'interval':>8}  {'strategy':<8} {'resolved':<8} {'frames':>7} {'wall s':>8} {'frames/s':>9}")
+    for interval in args.interval or [0.5, 2.0]:
+        for strategy in SAMPLING_STRATEGIES:
+            resolved, frames, elapsed = run_strategy(video_path, strategy, interval)
+            rate = frames / elapsed if elapsed > 0 else 0.0
+            print(f"{interval:>8.2f}  {strategy:<8} {resolved:<8} {frames:>7} {elapsed:>8.2f} {rate:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark backend cold start.
+
+Measures, in fresh interpreters, how long `import main` takes and how long
+until a uvicorn server answers `GET /`, then lists the slowest top-level
+imports. Model warm-up is disabled so only the startup path is timed.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--max-seconds 2.0]
+
+With --max-seconds the script exits non-zero when the median time to the
+first response exceeds the budget, so it can guard against regressions
+such as a heavy ML import creeping back into module scope.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Run from a scratch directory so the benchmark does not create or touch neuralplay.db
+WORK_DIR = tempfile.mkdtemp(prefix='neuralplay-startup-')
+
+
+def _env():
+    env = dict(os.environ)
+    env['NEURALPLAY_WARMUP'] = '0'
+    env['PYTHONPATH'] = BACKEND_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def time_import():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import main'], cwd=WORK_DIR, env=_env(),
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_first_response(timeout=60):
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port),
+                             '--log-level', 'warning'],
+                            cwd=WORK_DIR, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+                return time.perf_counter() - started
+            except OSError:
+                if proc.poll() is not None:
+                    raise RuntimeError('Backend exited during startup')
+                time.sleep(0.02)
+        raise RuntimeError(f'Backend did not answer within {timeout}s')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def slowest_imports(count=10):
+    """Cumulative import time of the modules main pulls in, from -X importtime"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=WORK_DIR,
+                            env=_env(), capture_output=True, text=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only modules imported directly by main (one level of indentation)
+        if name.startswith('   ') and not name.startswith('     '):
+            timings.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(timings, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float)
+    args = parser.parse_args()
+
+    imports = [time_import() for _ in range(args.runs)]
+    responses = [time_first_response() for _ in range(args.runs)]
+
+    print(f"{'measure':<22} {'median s':>9} {'min s':>7} {'max s':>7}")
+    for label, samples in (('import main', imports), ('first GET /', responses)):
+        print(f"{label:<22} {statistics.median(samples):>9.3f} {min(samples):>7.3f} {max(samples):>7.3f}")
+
+    print("\nslowest imports from main:")
+    for seconds, name in slowest_imports():
+        print(f"  {seconds:>7.3f}s  {name}")
+
+    if args.max_seconds is not None and statistics.median(responses) > args.max_seconds:
+        print(f"\nFAIL: median startup {statistics.median(responses):.3f}s exceeds {args.max_seconds:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from analysis_cache import video_fingerprint
+from database import SessionLocal, KeyframeIndex, get_or_create_video
+from transcription import _startupinfo
+
+TRIM_MODES = ("smart", "fast", "accurate")
+
+# Encoders for the re-encoded clip edges, by source codec; other codecs are trimmed like mode="fast"
+EDGE_ENCODERS = {"h264": "libx264", "hevc": "libx265", "mpeg4": "mpeg4"}
+# Edges are short, so quality matters more than encoder speed
+EDGE_QUALITY = ["-preset", "veryfast", "-crf", "16"]
+# Cuts this close to a keyframe are treated as on it
+KEYFRAME_TOLERANCE = 0.001
+# Container of the intermediate segments; MPEG-TS repeats the parameter sets in-band
+SEGMENT_EXT = ".ts"
+# ffmpeg jobs running at once for a batch export; each job is its own ffmpeg process
+EXPORT_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+# "Stream #0:0(und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(progressive), 1920x1080, ..."
+_VIDEO_STREAM = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+)[^,]*, (\w+)")
+
+_index_lock = threading.Lock()
+# Fingerprints of files the probe failed on, not retried until the file or the process changes
+_unindexable = set()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _ffmpeg(args):
+    subprocess.run(['ffmpeg', '-y', '-v', 'error'] + args, check=True, capture_output=True,
+                   startupinfo=_startupinfo())
+
+
+def probe_keyframes(video_path):
+    """(stream info, keyframe times) of the first video stream, read from packet flags without decoding.
+
+    Uses ffmpeg alone, since the bundled ffmpeg-static has no ffprobe: the
+    framecrc muxer lists every packet of a stream copy with its timestamp
+    and flags, and the input summary on stderr gives codec and pixel format.
+    """
+    cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-i', video_path,
+           '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-']
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True, startupinfo=_startupinfo())
+    stream = {}
+    match = _VIDEO_STREAM.search(result.stderr)
+    if match:
+        stream["codec_name"], stream["pix_fmt"] = match.groups()
+    time_base = 1.0
+    times = []
+    for line in result.stdout.splitlines():
+        if line.startswith("#"):
+            key, _, value = line[1:].partition(":")
+            value = value.strip()
+            if key == "tb 0":
+                num, den = value.split("/")
+                time_base = int(num) / int(den)
+            elif key == "dimensions 0":
+                stream["width"], stream["height"] = (int(v) for v in value.split("x"))
+            continue
+        # stream, dts, pts, duration, size, checksum[, F=flags]; the flags are only listed when not just "key"
+        fields = [field.strip() for field in line.split(",")]
+        flags = next((int(field[2:], 16) for field in fields[6:] if field.startswith("F=")), 1)
+        if flags & 1:
+            times.append(int(fields[2]) * time_base)
+    return stream, sorted(times)
+
+
+def get_keyframe_index(video_path):
+    """(stream info, keyframe times) for the current version of the file, probed once and kept in the DB.
+
+    None if the file cannot be indexed; that is remembered too, so a failing
+    probe is not repeated on every trim.
+    """
+    fingerprint = video_fingerprint(video_path)
+    with _index_lock:
+        if fingerprint in _unindexable:
+            return None
+        session = SessionLocal()
+        try:
+            video = get_or_create_video(session, video_path)
+            row = session.query(KeyframeIndex).filter(KeyframeIndex.video_id == video.id).first()
+            if row is not None and row.fingerprint == fingerprint:
+                return json.loads(row.stream), json.loads(row.times)
+
+            try:
+                stream, times = probe_keyframes(video_path)
+            except Exception as e:
+                print(f"[ClipExport] Could not index keyframes of {video_path}: {e}")
+                _unindexable.add(fingerprint)
+                return None
+            if row is None:
+                row = KeyframeIndex(video_id=video.id)
+                session.add(row)
+            row.fingerprint = fingerprint
+            row.stream = json.dumps(stream)
+            row.times = json.dumps(times)
+            session.commit()
+            print(f"[ClipExport] Indexed {len(times)} keyframes of {os.path.basename(video_path)}")
+            return stream, times
+        finally:
+            session.close()
+
+
+def clip_output_path(video_path, index=None):
+    dir_name = os.path.dirname(video_path)
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    suffix = f"_{index}" if index is not None else ""
+    return os.path.join(dir_name, f"{base_name}_clip_{int(time.time())}{suffix}.mp4")
+
+
+def _encode_segment(video_path, start, duration, encoder, pix_fmt, output_path):
+    args = ['-ss', f'{start:.6f}', '-i', video_path, '-t', f'{duration:.6f}', '-map', '0:v:0', '-an',
+            '-c:v', encoder] + EDGE_QUALITY
+    if pix_fmt:
+        args += ['-pix_fmt', pix_fmt]
+    _ffmpeg(args + [output_path])
+
+
+def _copy_segment(video_path, start, duration, output_path):
+    # start is a keyframe, so input seeking lands on it exactly
+    _ffmpeg(['-ss', f'{start:.6f}', '-i', video_path, '-t', f'{duration:.6f}', '-map', '0:v:0', '-an',
+             '-c:v', 'copy', output_path])
+
+
+def trim_fast(video_path, start, end, output_path):
+    """Stream copy from the keyframe before start; fast, but the clip edges snap to keyframes"""
+    _ffmpeg(['-ss', str(start), '-to', str(end), '-i', video_path, '-c', 'copy', output_path])
+
+
+def trim_accurate(video_path, start, end, output_path):
+    """Re-encode the whole clip; frame accurate but as slow as the clip is long"""
+    _ffmpeg(['-ss', f'{start:.6f}', '-i', video_path, '-t', f'{end - start:.6f}',
+             '-map', '0:v:0', '-map', '0:a?', '-c:v', 'libx264'] + EDGE_QUALITY + ['-c:a', 'aac', output_path])
+
+
+def trim_smart(video_path, start, end, output_path, index=None):
+    """Frame-accurate trim that re-encodes only the partial GOPs at the clip edges.
+
+    The keyframe-aligned middle is stream copied. Segments are written as
+    MPEG-TS so each carries its own parameter sets, then concatenated
+    without re-encoding; audio is stream copied from the source, which is
+    accurate to one audio frame. Falls back to trim_fast when there is no
+    keyframe index or the codec has no matching encoder, since re-encoding
+    the whole clip instead could take minutes; the returned method says
+    which one ran.
+    """
+    index = index or get_keyframe_index(video_path)
+    encoder = EDGE_ENCODERS.get(index[0].get("codec_name")) if index else None
+    if encoder is None:
+        trim_fast(video_path, start, end, output_path)
+        return "fast"
+    stream, keyframes = index
+
+    first = keyframes[bisect_left(keyframes, start - KEYFRAME_TOLERANCE):]
+    inner = first[:bisect_right(first, end + KEYFRAME_TOLERANCE)]
+    if len(inner) < 2:
+        # No whole GOP inside the clip, so it is at most two partial GOPs: re-encode it all
+        trim_accurate(video_path, start, end, output_path)
+        return "accurate"
+    copy_start, copy_end = inner[0], inner[-1]
+
+    workdir = tempfile.mkdtemp(prefix="neuralplay-trim-")
+    try:
+        segments = []
+        if copy_start - start > KEYFRAME_TOLERANCE:
+            segments.append(os.path.join(workdir, "head" + SEGMENT_EXT))
+            _encode_segment(video_path, start, copy_start - start, encoder, stream.get("pix_fmt"), segments[-1])
+        segments.append(os.path.join(workdir, "middle" + SEGMENT_EXT))
+        _copy_segment(video_path, copy_start, copy_end - copy_start, segments[-1])
+        if end - copy_end > KEYFRAME_TOLERANCE:
+            segments.append(os.path.join(workdir, "tail" + SEGMENT_EXT))
+            _encode_segment(video_path, copy_end, end - copy_end, encoder, stream.get("pix_fmt"), segments[-1])
+
+        list_path = os.path.join(workdir, "segments.txt")
+        with open(list_path, "w") as f:
+            f.writelines(f"file '{segment}'\n" for segment in segments)
+        _ffmpeg(['-f', 'concat', '-safe', '0', '-i', list_path,
+                 '-ss', f'{start:.6f}', '-t', f'{end - start:.6f}', '-i', video_path,
+                 '-map', '0:v:0', '-map', '1:a?', '-c', 'copy', '-movflags', '+faststart', output_path])
+        return "smart"
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def trim_clip(video_path, start, end, output_path, mode="smart", index=None):
+    """Cut [start, end] seconds into output_path; returns the result dict of /trim_video"""
+    if end <= start:
+        return {"error": "Clip end must be after its start"}
+    started = time.perf_counter()
+    try:
+        if mode == "fast":
+            trim_fast(video_path, start, end, output_path)
+            method = "fast"
+        elif mode == "accurate":
+            trim_accurate(video_path, start, end, output_path)
+            method = "accurate"
+        else:
+            method = trim_smart(video_path, start, end, output_path, index)
+        return {"status": "success", "output_path": output_path, "method": method,
+                "seconds": round(time.perf_counter() - started, 2),
+                "message": f"Clip saved to {output_path}"}
+    except subprocess.CalledProcessError as e:
+        return {"error": f"FFmpeg failed: {e.stderr.decode() if e.stderr else str(e)}"}
+    except Exception as e:
+        return {"error": f"Trimming failed: {str(e)}"}
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="clip-export")
+        return _executor
+
+
+def export_clips(video_path, clips, mode="smart"):
+    """Trim several (start, end) clips of one video, at most EXPORT_WORKERS ffmpeg jobs at a time.
+
+    The keyframe index is built once up front; a failed clip does not stop the others.
+    """
+    index = get_keyframe_index(video_path) if mode == "smart" else None
+    futures = [_get_executor().submit(trim_clip, video_path, start, end, clip_output_path(video_path, i), mode, index)
+               for i, (start, end) in enumerate(clips)]
+    return [dict(future.result(), start=start, end=end) for future, (start, end) in zip(futures, clips)]
@@ -1,11 +1,26 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, Text, ForeignKey, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 import os
+import re
+import time
+import uuid
+
+from metrics import DB_WRITE_SECONDS
 
 DATABASE_URL = "sqlite:///./neuralplay.db"
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets searches read while transcription writes segments
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -27,5 +42,308 @@ class Transcript(Base):
     
     video = relationship("Video", back_populates="transcript")
 
+class TranscriptStatus(Base):
+    """Marks a video whose transcript covers the whole file"""
+    __tablename__ = "transcript_status"
+    id = Column(Integer, primary_key=True, index=True)
+    video_id = Column(Integer, ForeignKey("videos.id"), unique=True, index=True)
+    segments = Column(Integer)
+    completed_at = Column(Float)
+
+class TranscriptStaging(Base):
+    """Segments of a transcription run in progress, moved into transcripts when the run completes"""
+    __tablename__ = "transcript_staging"
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, index=True)
+    video_id = Column(Integer, ForeignKey("videos.id"))
+    text = Column(Text)
+    start_time = Column(Float)
+    end_time = Column(Float)
+
+# Full-text index over transcript segments, kept in sync by triggers
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+        text, content='transcripts', content_rowid='id', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS transcripts_fts_ai AFTER INSERT ON transcripts BEGIN
+        INSERT INTO transcripts_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transcripts_fts_ad AFTER DELETE ON transcripts BEGIN
+        INSERT INTO transcripts_fts(transcripts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transcripts_fts_au AFTER UPDATE ON transcripts BEGIN
+        INSERT INTO transcripts_fts(transcripts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO transcripts_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+]
+
+FTS_AVAILABLE = False
+
+def init_fts():
+    """Create the FTS5 index, backfilling it when it is created for an existing database"""
+    global FTS_AVAILABLE
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'transcripts_fts'"
+            )).first() is not None
+            for statement in FTS_SCHEMA:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text("INSERT INTO transcripts_fts(transcripts_fts) VALUES ('rebuild')"))
+        FTS_AVAILABLE = True
+    except OperationalError as e:
+        print(f"[Database] FTS5 unavailable, falling back to LIKE search: {e}")
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    init_fts()
+    # Runs still staged when the server stopped never completed
+    with engine.begin() as conn:
+        conn.execute(TranscriptStaging.__table__.delete())
+
+class AnalysisRun(Base):
+    """One completed analyzer pass over a video, keyed by file fingerprint and parameters"""
+    __tablename__ = "analysis_runs"
+    id = Column(Integer, primary_key=True, index=True)
+    video_id = Column(Integer, ForeignKey("videos.id"), index=True)
+    analyzer = Column(String, index=True)
+    params = Column(String)
+    fingerprint = Column(String)
+    summary = Column(Text)
+    created_at = Column(Float)
+
+class Scene(Base):
+    __tablename__ = "scenes"
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("analysis_runs.id"), index=True)
+    scene_index = Column(Integer)
+    start_time = Column(Float)
+    end_time = Column(Float)
+    duration = Column(Float)
+    confidence = Column(Float, nullable=True)
+
+class ObjectDetection(Base):
+    __tablename__ = "object_detections"
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("analysis_runs.id"), index=True)
+    time = Column(Float)
+    objects = Column(Text)  # JSON list of labels
+
+class ObjectInterval(Base):
+    __tablename__ = "object_intervals"
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("analysis_runs.id"), index=True)
+    track_id = Column(Integer)
+    label = Column(String, index=True)
+    start_time = Column(Float)
+    end_time = Column(Float)
+    samples = Column(Integer)
+    confidence = Column(Float)
+
+class EmotionSample(Base):
+    __tablename__ = "emotion_samples"
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("analysis_runs.id"), index=True)
+    time = Column(Float)
+    emotions = Column(Text)  # JSON list of dominant emotions
+
+class KeyframeIndex(Base):
+    __tablename__ = "keyframe_indexes"
+    id = Column(Integer, primary_key=True, index=True)
+    video_id = Column(Integer, ForeignKey("videos.id"), unique=True, index=True)
+    fingerprint = Column(String)
+    stream = Column(Text)  # JSON: codec_name, pix_fmt, width, height of the first video stream
+    times = Column(Text)   # JSON list of keyframe timestamps in seconds, ascending
+
+def get_or_create_video(session, video_path):
+    video = session.query(Video).filter(Video.path == video_path).first()
+    if not video:
+        video = Video(path=video_path, name=os.path.basename(video_path))
+        session.add(video)
+        session.commit()
+        session.refresh(video)
+    return video
+
+# Called with the video path whenever a transcript is replaced or extended,
+# e.g. to drop in-memory indexes built from the old rows
+transcript_listeners = []
+
+def _transcript_changed(video_path):
+    for listener in transcript_listeners:
+        listener(video_path)
+
+def has_transcript(video_path):
+    """True once a complete transcript is stored; partial rows of an interrupted run do not count"""
+    session = SessionLocal()
+    try:
+        return session.query(TranscriptStatus.id).join(Video, Video.id == TranscriptStatus.video_id) \
+            .filter(Video.path == video_path).first() is not None
+    finally:
+        session.close()
+
+def _mark_complete(conn, video_id, segments):
+    conn.execute(text("""
+        INSERT INTO transcript_status (video_id, segments, completed_at) VALUES (:video_id, :segments, :now)
+        ON CONFLICT(video_id) DO UPDATE SET segments = excluded.segments, completed_at = excluded.completed_at
+    """), {"video_id": video_id, "segments": segments, "now": time.time()})
+
+def _transcript_rows(video_id, segments):
+    return [{
+        "video_id": video_id,
+        "text": seg["text"],
+        "start_time": seg["start"],
+        "end_time": seg["end"]
+    } for seg in segments]
+
+def replace_transcript(video_path, segments):
+    """Replace a video's transcript with one bulk insert in a single transaction"""
+    started = time.perf_counter()
+    session = SessionLocal()
+    try:
+        video = get_or_create_video(session, video_path)
+        session.query(Transcript).filter(Transcript.video_id == video.id).delete()
+        rows = _transcript_rows(video.id, segments)
+        if rows:
+            session.execute(Transcript.__table__.insert(), rows)
+        _mark_complete(session, video.id, len(rows))
+        session.commit()
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started, "transcripts")
+        _transcript_changed(video_path)
+        return len(rows)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+class TranscriptWriter:
+    """Writes transcript segments as they are produced, in batched executemany inserts.
+
+    Segments go to staging rows under a run id; commit() swaps them in for
+    the video's previous transcript in one transaction. Closing the writer
+    without committing, e.g. on cancel or error, discards them, so the
+    previous transcript stays intact.
+    """
+
+    def __init__(self, video_path, batch_size=100):
+        self.video_path = video_path
+        self.batch_size = batch_size
+        self.pending = []
+        self.count = 0
+        self.run_id = uuid.uuid4().hex
+        self.committed = False
+        session = SessionLocal()
+        try:
+            self.video_id = get_or_create_video(session, video_path).id
+        finally:
+            session.close()
+
+    def add(self, segment):
+        self.pending.append(segment)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        rows = _transcript_rows(self.video_id, self.pending)
+        for row in rows:
+            row["run_id"] = self.run_id
+        with DB_WRITE_SECONDS.time("transcripts"), engine.begin() as conn:
+            conn.execute(TranscriptStaging.__table__.insert(), rows)
+        self.count += len(rows)
+        self.pending = []
+
+    def commit(self):
+        """Replace the video's transcript with this run's segments, in time order"""
+        self.flush()
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM transcripts WHERE video_id = :video_id"), {"video_id": self.video_id})
+            conn.execute(text("""
+                INSERT INTO transcripts (video_id, text, start_time, end_time)
+                SELECT video_id, text, start_time, end_time FROM transcript_staging
+                WHERE run_id = :run_id ORDER BY start_time, id
+            """), {"run_id": self.run_id})
+            conn.execute(text("DELETE FROM transcript_staging WHERE run_id = :run_id"), {"run_id": self.run_id})
+            _mark_complete(conn, self.video_id, self.count)
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started, "transcripts")
+        self.committed = True
+        _transcript_changed(self.video_path)
+
+    def close(self):
+        """Discard the staged segments unless the run was committed"""
+        self.pending = []
+        if self.committed:
+            return
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM transcript_staging WHERE run_id = :run_id"), {"run_id": self.run_id})
+
+_FTS_TOKEN = re.compile(r'"([^"]+)"|(\S+)')
+
+def build_fts_query(query):
+    """Turn user input into a safe FTS5 query.
+
+    Words are ANDed, "quoted text" is a phrase and a trailing * makes a prefix query.
+    """
+    terms = []
+    for phrase, word in _FTS_TOKEN.findall(query):
+        if phrase:
+            words = re.findall(r'\w+', phrase)
+            if words:
+                terms.append('"' + " ".join(words) + '"')
+            continue
+        prefix = word.endswith("*")
+        words = re.findall(r'\w+', word)
+        if not words:
+            continue
+        term = '"' + " ".join(words) + '"'
+        terms.append(term + "*" if prefix else term)
+    return " ".join(terms)
+
+def search_transcripts(session, query, video_id=None, limit=50, offset=0):
+    """Ranked transcript search returning segment rows with video info and a snippet"""
+    filters = ""
+    params = {"limit": limit, "offset": offset}
+    if video_id is not None:
+        filters = " AND t.video_id = :video_id"
+        params["video_id"] = video_id
+
+    if FTS_AVAILABLE:
+        params["query"] = build_fts_query(query)
+        if not params["query"]:
+            return []
+        sql = f"""
+            SELECT t.start_time, t.end_time, t.text, v.path, v.name,
+                   snippet(transcripts_fts, 0, '<mark>', '</mark>', '...', 12) AS snippet,
+                   bm25(transcripts_fts) AS score
+            FROM transcripts_fts
+            JOIN transcripts t ON t.id = transcripts_fts.rowid
+            JOIN videos v ON v.id = t.video_id
+            WHERE transcripts_fts MATCH :query{filters}
+            ORDER BY score
+            LIMIT :limit OFFSET :offset
+        """
+    else:
+        params["query"] = f"%{query}%"
+        sql = f"""
+            SELECT t.start_time, t.end_time, t.text, v.path, v.name,
+                   t.text AS snippet, 0.0 AS score
+            FROM transcripts t
+            JOIN videos v ON v.id = t.video_id
+            WHERE t.text LIKE :query{filters}
+            ORDER BY t.video_id, t.start_time
+            LIMIT :limit OFFSET :offset
+        """
+
+    rows = session.execute(text(sql), params).fetchall()
+    return [{
+        "start": row.start_time,
+        "end": row.end_time,
+        "text": row.text,
+        "video_path": row.path,
+        "video_name": row.name,
+        "snippet": row.snippet,
+        "score": round(-row.score, 4) if FTS_AVAILABLE else 0.0
+    } for row in rows]
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from analysis_cache import video_fingerprint
+
+# Next to neuralplay.db; one .npy per column (plus a small .json) per video
+DETECTIONS_DIR = os.environ.get("NEURALPLAY_DETECTIONS_DIR", "./detections")
+# Detection files kept memory-mapped for /detections
+OPEN_FILES = 16
+# Part of the objects cache key; bumping it re-runs cached analyses so their boxes get stored
+DETECTION_FORMAT = 2
+
+# One contiguous array per column, all sorted by t
+COLUMNS = {
+    "t": (np.dtype("<f8"), ()),
+    "cls": (np.dtype("<i2"), ()),
+    "conf": (np.dtype("<f4"), ()),
+    "xyxy": (np.dtype("<f4"), (4,)),
+}
+
+
+def _base_path(video_path):
+    name = hashlib.sha1(os.path.abspath(video_path).encode("utf-8")).hexdigest()
+    return os.path.join(DETECTIONS_DIR, name)
+
+
+def _column_path(base, generation, column):
+    return f"{base}.{generation}.{column}.npy"
+
+
+def to_columns(times, predictions):
+    """Columns for one batch of YOLO output: predictions are (cls, conf, xyxy) per frame time"""
+    counts = [len(cls) for cls, _, _ in predictions]
+    if not sum(counts):
+        return _empty_columns()
+    return {
+        "t": np.repeat(np.asarray(times, dtype=COLUMNS["t"][0]), counts),
+        "cls": np.concatenate([cls for cls, _, _ in predictions]).astype(COLUMNS["cls"][0]),
+        "conf": np.concatenate([conf for _, conf, _ in predictions]).astype(COLUMNS["conf"][0]),
+        "xyxy": np.concatenate([xyxy for _, _, xyxy in predictions]).astype(COLUMNS["xyxy"][0]),
+    }
+
+
+def _empty_columns():
+    return {name: np.zeros((0,) + shape, dtype=dtype) for name, (dtype, shape) in COLUMNS.items()}
+
+
+def save_detections(video_path, batches, names, frame_size):
+    """Replace the stored detections of a video with the batches of a completed run.
+
+    Every save writes a new generation of column files and then switches the
+    .json over to it, so files that readers have mapped are never replaced
+    (Windows refuses to replace a mapped file) and a reader never sees half
+    a run. Older generations are deleted once they are no longer mapped.
+    """
+    columns = {name: np.concatenate([batch[name] for batch in batches]) for name in COLUMNS}
+    order = np.argsort(columns["t"], kind="stable")
+    base = _base_path(video_path)
+    generation = time.time_ns()
+    meta = {
+        "video_path": os.path.abspath(video_path),
+        "fingerprint": video_fingerprint(video_path),
+        "generation": generation,
+        "names": {int(k): v for k, v in names.items()},
+        "width": frame_size[0],
+        "height": frame_size[1],
+        "count": int(len(order)),
+    }
+    try:
+        os.makedirs(DETECTIONS_DIR, exist_ok=True)
+        for name, values in columns.items():
+            np.save(_column_path(base, generation, name), np.ascontiguousarray(values[order]))
+        with open(base + ".json.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(base + ".json.tmp", base + ".json")
+    except OSError as e:
+        print(f"[DetectionStore] Could not save detections for {video_path}: {e}")
+        return
+    detection_files.evict(video_path)
+    _remove_old_generations(base, generation)
+
+
+def _remove_old_generations(base, generation):
+    for path in glob.glob(glob.escape(base) + ".*npy"):
+        if not os.path.basename(path).startswith(f"{os.path.basename(base)}.{generation}."):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Still mapped by a query in progress; removed after the next save
+
+
+class DetectionFiles:
+    """LRU of memory-mapped detection columns.
+
+    An entry is keyed by the .json's mtime, so a newer run is picked up on
+    the next request; only the pages a query touches are ever read.
+    """
+
+    def __init__(self, capacity=OPEN_FILES):
+        self.capacity = capacity
+        self.files = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, video_path):
+        """(columns, meta) for the current version of the video, or None"""
+        base = _base_path(video_path)
+        try:
+            stamp = os.stat(base + ".json").st_mtime_ns
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.files.get(video_path)
+            if entry is not None and entry[0] == stamp:
+                self.files.move_to_end(video_path)
+                return entry[1], entry[2]
+        try:
+            with open(base + ".json") as f:
+                meta = json.load(f)
+            if meta["fingerprint"] != video_fingerprint(video_path):
+                return None  # The file changed since it was analyzed
+            if meta["count"] == 0:
+                columns = _empty_columns()  # An empty file cannot be mapped
+            else:
+                columns = {name: np.load(_column_path(base, meta["generation"], name), mmap_mode="r")
+                           for name in COLUMNS}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[DetectionStore] Could not open detections for {video_path}: {e}")
+            return None
+        with self.lock:
+            self.files[video_path] = (stamp, columns, meta)
+            self.files.move_to_end(video_path)
+            while len(self.files) > self.capacity:
+                self.files.popitem(last=False)
+        return columns, meta
+
+    def evict(self, video_path):
+        """Drop the maps of a video, so its old files can be deleted"""
+        with self.lock:
+            self.files.pop(video_path, None)
+
+
+detection_files = DetectionFiles()
+
+
+def time_window(columns, start, end):
+    """Rows with start <= t <= end, found by binary search on the mapped, sorted t column"""
+    times = columns["t"]
+    lo = int(np.searchsorted(times, start, side="left"))
+    hi = int(np.searchsorted(times, end, side="right")) if end is not None else len(times)
+    return {name: values[lo:hi] for name, values in columns.items()}
+
+
+def query_detections(video_path, start=0.0, end=None, min_conf=0.0):
+    """Boxes between start and end seconds in columnar form, for drawing overlays"""
+    if not os.path.exists(video_path):
+        return {"error": "File not found"}
+    stored = detection_files.get(video_path)
+    if stored is None:
+        return {"error": "No detections stored for this video. Run object detection first."}
+    columns, meta = stored
+    window = time_window(columns, start, end)
+    if min_conf > 0:
+        keep = window["conf"] >= min_conf
+        window = {name: values[keep] for name, values in window.items()}
+    names = meta["names"]
+    return {
+        "start": start,
+        "end": end,
+        "width": meta["width"],
+        "height": meta["height"],
+        "count": int(len(window["t"])),
+        "names": {str(c): names.get(str(c), str(c)) for c in np.unique(window["cls"]).tolist()},
+        "t": window["t"].tolist(),
+        "cls": window["cls"].tolist(),
+        "conf": np.round(window["conf"].astype(np.float64), 3).tolist(),
+        "xyxy": np.round(window["xyxy"].astype(np.float64), 1).tolist(),
+    }
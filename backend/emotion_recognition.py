@@ -1,78 +1,244 @@
 import cv2
-import os
 import json
 import logging
+import threading
+
+import numpy as np
+
+from analysis_cache import run_analysis
+from frame_source import Analyzer, make_gate
+from inference_pool import InFlight, get_scheduler
+from metrics import INFERENCE_ITEMS, INFERENCE_SECONDS, PREPROCESS_SECONDS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Lazy loading - DeepFace loads on first use
 _deepface = None
+_deepface_lock = threading.Lock()
 
 def get_deepface():
     global _deepface
-    if _deepface is None:
-        try:
-            from deepface import DeepFace
-            _deepface = DeepFace
-            print("[EmotionRecognition] DeepFace loaded successfully")
-        except ImportError:
-            print("[EmotionRecognition] DeepFace not installed")
-            return None
-        except Exception as e:
-            print(f"[EmotionRecognition] Error loading DeepFace: {e}")
-            return None
-    return _deepface
-
-def detect_emotions_streaming(video_path, interval_seconds=3.0):
-    """Generator that yields emotions as they are detected"""
-    DeepFace = get_deepface()
-    
-    if DeepFace is None:
-        yield json.dumps({"error": "DeepFace not installed. Run: pip install deepface tf-keras"})
-        return
-    
-    if not os.path.exists(video_path):
-        yield json.dumps({"error": "File not found"})
-        return
-
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        yield json.dumps({"error": "Could not open video"})
-        return
-
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30
-    frame_interval = int(fps * interval_seconds)
-    frame_count = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        if frame_count % frame_interval == 0:
-            current_time = frame_count / fps
+    with _deepface_lock:
+        if _deepface is None:
             try:
-                predictions = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False, silent=True)
-                frame_emotions = [pred['dominant_emotion'] for pred in predictions]
+                from deepface import DeepFace
+                _deepface = DeepFace
+                print("[EmotionRecognition] DeepFace loaded successfully")
+            except ImportError:
+                print("[EmotionRecognition] DeepFace not installed")
+                return None
+            except Exception as e:
+                print(f"[EmotionRecognition] Error loading DeepFace: {e}")
+                return None
+        return _deepface
+
+# Labels of the DeepFace emotion model, in output order
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+EMOTION_INPUT_SIZE = 48
+
+# Face prefilter runs on frames scaled down to this width
+DETECT_WIDTH = 320
+# Sampled frames handed to the emotions scheduler at once
+DEFAULT_BATCH_SIZE = 8
+
+_emotion_model = None
+_emotion_model_lock = threading.Lock()
+
+def get_emotion_model():
+    """The Keras emotion classifier inside DeepFace, for batched forward passes"""
+    global _emotion_model
+    with _emotion_model_lock:
+        if _emotion_model is None:
+            deepface = get_deepface()
+            if deepface is None:
+                return None
+            try:
+                try:
+                    client = deepface.build_model(model_name="Emotion", task="facial_attribute")
+                except TypeError:
+                    # Older DeepFace releases take only the model name
+                    client = deepface.build_model("Emotion")
+                _emotion_model = getattr(client, "model", client)
+                print("[EmotionRecognition] Emotion model loaded")
+            except Exception as e:
+                print(f"[EmotionRecognition] Error loading emotion model: {e}")
+                return None
+        return _emotion_model
+
+_face_detector = None
+_face_detector_lock = threading.Lock()
+
+def get_face_detector():
+    """OpenCV's bundled frontal-face Haar cascade, or None if this OpenCV build lacks it"""
+    global _face_detector
+    with _face_detector_lock:
+        if _face_detector is None:
+            if not hasattr(cv2, "CascadeClassifier") or not hasattr(cv2, "data"):
+                print(f"[EmotionRecognition] OpenCV {cv2.__version__} has no Haar cascades "
+                      "(install opencv-python-headless<5), face prefilter disabled")
+                return None
+            detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+            if detector.empty():
+                print("[EmotionRecognition] Could not load the face cascade, face prefilter disabled")
+                return None
+            _face_detector = detector
+        return _face_detector
+
+def detect_faces(detector, frame):
+    """Face boxes (x, y, w, h) in full-frame coordinates, found on a downscaled grayscale copy"""
+    height, width = frame.shape[:2]
+    scale = min(1.0, DETECT_WIDTH / width)
+    if scale < 1:
+        frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    small = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    faces = detector.detectMultiScale(small, scaleFactor=1.1, minNeighbors=5, minSize=(20, 20))
+    return [tuple(int(v / scale) for v in face) for face in faces]
+
+def face_crops(frame, faces):
+    """48x48 grayscale crops of the full-resolution frame scaled to [0, 1], the emotion model's input"""
+    crops = np.empty((len(faces), EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 1), dtype=np.float32)
+    for i, (x, y, w, h) in enumerate(faces):
+        crop = cv2.cvtColor(frame[y:y + h, x:x + w], cv2.COLOR_BGR2GRAY)
+        crops[i, :, :, 0] = cv2.resize(crop, (EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE), interpolation=cv2.INTER_AREA)
+    crops /= 255.0
+    return crops
+
+def _analyze_frame(deepface, frame):
+    try:
+        with INFERENCE_SECONDS.time("emotions"):
+            predictions = deepface.analyze(frame, actions=['emotion'], enforce_detection=False, silent=True)
+        INFERENCE_ITEMS.inc("emotions")
+        return [pred['dominant_emotion'] for pred in predictions]
+    except Exception as e:
+        # One bad frame must not fail the other analyses sharing the batch
+        logger.error(f"Error analyzing frame: {e}")
+        return []
+
+def classify_frames(frames):
+    """Emotion labels of every face in each frame, one list per frame.
+
+    Frames go through the cheap Haar face detector first and the faces of all
+    frames share one forward pass of the emotion model; frames without faces
+    cost only the detector. Without the detector or the bare model it falls
+    back to DeepFace.analyze on every full frame.
+    """
+    detector = get_face_detector()
+    model = get_emotion_model() if detector is not None else None
+    if model is None:
+        return [_analyze_frame(get_deepface(), frame) for frame in frames]
+
+    with PREPROCESS_SECONDS.time("emotions"):
+        crops = [face_crops(frame, detect_faces(detector, frame)) for frame in frames]
+    if not any(len(c) for c in crops):
+        return [[] for _ in frames]
+    batch = np.concatenate(crops)
+    with INFERENCE_SECONDS.time("emotions"):
+        labels = np.asarray(model.predict(batch, verbose=0)).argmax(axis=1)
+    INFERENCE_ITEMS.inc("emotions", amount=len(batch))
+    results = []
+    start = 0
+    for frame_crops in crops:
+        results.append([EMOTION_LABELS[int(label)] for label in labels[start:start + len(frame_crops)]])
+        start += len(frame_crops)
+    return results
+
+class EmotionAnalyzer(Analyzer):
+    """Emits the dominant emotion of each face in sampled frames.
+
+    Sampled frames go to the shared emotions scheduler in small groups and
+    are classified with classify_frames, together with other analyses' frames.
+    """
+    name = "emotions"
+
+    def __init__(self, interval_seconds=3.0, batch_size=DEFAULT_BATCH_SIZE, sampling="fixed",
+                 min_interval=None, max_interval=None):
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(1, int(batch_size))
+        self.gate = make_gate(sampling, interval_seconds, min_interval, max_interval)
+        self.method = None
+
+    def classify_method(self):
+        """The classify_frames path, "batched" or "deepface" (falsy without DeepFace), settled on the first call.
+
+        The cache lookup asks before start() and the stored run after it,
+        so both must see the same answer.
+        """
+        if self.method is None:
+            self.method = get_scheduler("emotions").available()
+        return self.method
+
+    def cache_params(self):
+        return {"interval_seconds": self.interval_seconds, "method": self.classify_method() or "unavailable",
+                "sampling": self.sampling_params()}
+
+    def start(self, fps, total_frames):
+        super().start(fps, total_frames)
+        self.scheduler = get_scheduler("emotions")
+        if not self.classify_method():
+            return "DeepFace not installed. Run: pip install deepface tf-keras"
+        self.submit_size = min(self.batch_size, self.scheduler.max_batch)
+        self.pending = []
+        self.in_flight = InFlight()
+        return None
+
+    def process(self, frame, frame_index):
+        self.pending.append((frame_index / self.fps, frame))
+        if len(self.pending) < self.submit_size:
+            return self._collect()
+        return self._flush()
+
+    def pending_time(self):
+        times = [self.pending[0][0]] if self.pending else []
+        if self.in_flight.earliest() is not None:
+            times.append(self.in_flight.earliest()[0])
+        return min(times) if times else None
+
+    def _flush(self):
+        times = [t for t, _ in self.pending]
+        frames = [frame for _, frame in self.pending]
+        self.pending = []
+        self.in_flight.add(times, self.scheduler.submit(self, self.video_path, frames))
+        return self._collect()
+
+    def _collect(self, wait_all=False):
+        events = []
+        for times, future in self.in_flight.take(wait_all):
+            try:
+                labels = future.result()
+            except Exception as e:
+                logger.error(f"Error at {times[0]}: {e}")
+                self.failed_batches += 1
+                continue
+            for current_time, frame_emotions in zip(times, labels):
                 if frame_emotions:
-                    emotion_data = {
+                    events.append((current_time, {
                         "type": "emotion",
                         "time": current_time,
                         "emotions": frame_emotions
-                    }
-                    yield json.dumps(emotion_data)
-            except Exception as e:
-                logger.error(f"Error at {current_time}: {e}")
-        
-        frame_count += 1
-        
-    cap.release()
-    yield json.dumps({"type": "done", "message": "Emotion detection complete"})
-
-def detect_emotions(video_path, interval_seconds=3.0):
+                    }))
+        return events
+
+    def finish(self, frame_count):
+        events = self._flush() if self.pending else []
+        events.extend(self._collect(wait_all=True))
+        events.append((frame_count / self.fps, {"type": "done", "message": "Emotion detection complete"}))
+        return events
+
+def detect_emotions_streaming(video_path, interval_seconds=3.0, use_cache=True, sampling="fixed",
+                              min_interval=None, max_interval=None):
+    """Generator that yields emotions as they are detected.
+
+    sampling="adaptive" looks for faces only when the picture changed,
+    between min_interval and max_interval seconds apart.
+    """
+    analyzer = EmotionAnalyzer(interval_seconds, sampling=sampling, min_interval=min_interval,
+                               max_interval=max_interval)
+    yield from run_analysis(video_path, [analyzer], use_cache)
+
+def detect_emotions(video_path, interval_seconds=3.0, sampling="fixed", min_interval=None, max_interval=None):
     emotions_list = []
-    for data in detect_emotions_streaming(video_path, interval_seconds):
+    for data in detect_emotions_streaming(video_path, interval_seconds, True, sampling, min_interval, max_interval):
         parsed = json.loads(data)
         if parsed.get("type") == "emotion":
             emotions_list.append({"time": parsed["time"], "emotions": parsed["emotions"]})
@@ -0,0 +1,418 @@
+import cv2
+import heapq
+import json
+import os
+import subprocess
+import time
+
+import numpy as np
+
+from metrics import ANALYSIS_FPS, FRAME_DECODE_SECONDS, SERIALIZE_SECONDS
+from transcription import setup_ffmpeg
+
+SAMPLING_STRATEGIES = ("auto", "read", "grab", "seek", "ffmpeg")
+SAMPLING_MODES = ("fixed", "adaptive")
+
+# Containers with a reliable index where OpenCV can seek to a keyframe cheaply
+SEEKABLE_CONTAINERS = {".mp4", ".m4v", ".mov", ".mkv", ".webm"}
+
+
+def _startupinfo():
+    # Hide console window on Windows
+    startupinfo = None
+    if os.name == 'nt':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+
+def estimate_gop(video_path, fps, probe_seconds=30):
+    """Estimate the keyframe distance in frames from the first keyframes of the file"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-skip_frame', 'nokey',
+        '-read_intervals', f'%+{probe_seconds}',
+        '-show_entries', 'frame=pts_time',
+        '-of', 'csv=p=0',
+        video_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, startupinfo=_startupinfo(), timeout=30)
+        times = [float(line.strip(' ,')) for line in result.stdout.splitlines() if line.strip(' ,')]
+    except Exception:
+        return None
+    if len(times) < 2:
+        return None
+    return max(1, int(np.median(np.diff(times)) * fps))
+
+
+class FrameSampler:
+    """Yields (frame_index, frame) for every index that is a multiple of one of `steps`.
+
+    Strategies:
+    - "read": decode and convert every frame (the old behaviour, kept for benchmarks)
+    - "grab": decode every frame but only convert the sampled ones via retrieve()
+    - "seek": jump to the next sample when it is further away than one GOP,
+      otherwise grab forward; cheapest for sparse sampling of indexed containers
+    - "ffmpeg": let an ffmpeg select filter drop frames and pipe raw BGR frames
+    - "auto": pick the cheapest of the above for this container and schedule
+    """
+
+    def __init__(self, video_path, cap, fps, total_frames, steps, strategy="auto"):
+        if strategy not in SAMPLING_STRATEGIES:
+            raise ValueError(f"Unknown sampling strategy: {strategy}")
+        self.video_path = video_path
+        self.cap = cap
+        self.fps = fps
+        self.total_frames = total_frames
+        self.steps = sorted(set(steps))
+        self.gop = None
+        self.frame_count = 0
+        self.strategy = self._choose() if strategy == "auto" else strategy
+
+    def _choose(self):
+        ext = os.path.splitext(self.video_path)[1].lower()
+        if self.total_frames > 0 and ext in SEEKABLE_CONTAINERS:
+            self.gop = estimate_gop(self.video_path, self.fps)
+            if self.gop is not None and self.steps[0] > self.gop:
+                return "seek"
+        return "grab"
+
+    def is_sample(self, index):
+        return any(index % step == 0 for step in self.steps)
+
+    def targets(self):
+        """Sampled frame indices in order, for strategies that know the length"""
+        index = 0
+        while index < self.total_frames:
+            yield index
+            index = min(index - index % step + step for step in self.steps)
+
+    def frames(self):
+        if self.strategy == "seek":
+            return self._seek()
+        if self.strategy == "ffmpeg":
+            return self._ffmpeg()
+        return self._sequential(retrieve_only_samples=self.strategy == "grab")
+
+    def _sequential(self, retrieve_only_samples):
+        cap = self.cap
+        index = 0
+        while True:
+            if retrieve_only_samples:
+                if not cap.grab():
+                    break
+                if self.is_sample(index):
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    yield index, frame
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if self.is_sample(index):
+                    yield index, frame
+            index += 1
+            self.frame_count = index
+
+    def _seek(self):
+        cap = self.cap
+        gop = self.gop or int(self.fps * 2)
+        position = 0
+        for target in self.targets():
+            if target - position > gop:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            else:
+                while position < target:
+                    if not cap.grab():
+                        return
+                    position += 1
+            ret, frame = cap.read()
+            if not ret:
+                return
+            position = target + 1
+            self.frame_count = position
+            yield target, frame
+        self.frame_count = max(self.frame_count, self.total_frames)
+
+    def _ffmpeg(self):
+        width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if not setup_ffmpeg() or width <= 0 or height <= 0:
+            yield from self._sequential(retrieve_only_samples=True)
+            return
+
+        select = "+".join(f"not(mod(n\\,{step}))" for step in self.steps)
+        cmd = [
+            'ffmpeg', '-v', 'error',
+            '-i', self.video_path,
+            '-map', '0:v:0',
+            '-vf', f"select={select}",
+            '-vsync', 'vfr',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-'
+        ]
+        frame_size = width * height * 3
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                startupinfo=_startupinfo(), bufsize=frame_size)
+        try:
+            targets = self.targets() if self.total_frames > 0 else self._unbounded_targets()
+            for target in targets:
+                raw = proc.stdout.read(frame_size)
+                if len(raw) < frame_size:
+                    break
+                self.frame_count = target + 1
+                yield target, np.frombuffer(raw, np.uint8).reshape(height, width, 3)
+        finally:
+            proc.kill()
+            proc.wait()
+        self.frame_count = max(self.frame_count, self.total_frames)
+
+    def _unbounded_targets(self):
+        index = 0
+        while True:
+            yield index
+            index = min(index - index % step + step for step in self.steps)
+
+
+def _encode(event):
+    started = time.perf_counter()
+    data = json.dumps(event)
+    SERIALIZE_SECONDS.observe(time.perf_counter() - started, "analysis")
+    return data
+
+
+# Thumbnail size for the cheap change signal of adaptive sampling
+CHANGE_THUMB_SIZE = (64, 36)
+# Grey-level change for a thumbnail pixel to count as moving
+MOTION_PIXEL_DELTA = 25
+
+
+def change_features(frame):
+    """Tiny HSV histogram and grayscale thumbnail used to decide whether a frame changed"""
+    thumb = cv2.resize(frame, CHANGE_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    hist = cv2.calcHist([cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV)], [0, 1], None, [16, 16], [0, 180, 0, 256])
+    cv2.normalize(hist, hist, 0, 1, cv2.NORM_MINMAX)
+    return hist, cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+
+
+class ChangeGate:
+    """Decides when an expensive analyzer should look at a frame in adaptive mode.
+
+    Frames are checked every min_interval seconds and compared with the last
+    frame that was analyzed: a colour histogram change (shot change) or
+    enough moving pixels (motion_threshold is a fraction of the picture)
+    triggers a sample, and one is taken at least every
+    max_interval seconds regardless. Static shots are then sampled at
+    max_interval and fast action at min_interval.
+    """
+
+    def __init__(self, min_interval=0.5, max_interval=4.0, hist_threshold=0.15, motion_threshold=0.05):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.hist_threshold = hist_threshold
+        self.motion_threshold = motion_threshold
+        self.reference = None
+        self.last_time = None
+
+    def params(self):
+        return {"mode": "adaptive", "min_interval": self.min_interval, "max_interval": self.max_interval,
+                "hist_threshold": self.hist_threshold, "motion_threshold": self.motion_threshold}
+
+    def should_sample(self, features, current_time):
+        if self.reference is None or current_time - self.last_time >= self.max_interval - 1e-6:
+            changed = True
+        else:
+            hist, gray = features
+            ref_hist, ref_gray = self.reference
+            difference = 1 - cv2.compareHist(ref_hist, hist, cv2.HISTCMP_CORREL)
+            motion = np.count_nonzero(cv2.absdiff(ref_gray, gray) > MOTION_PIXEL_DELTA) / gray.size
+            changed = difference > self.hist_threshold or motion > self.motion_threshold
+        if changed:
+            self.reference = features
+            self.last_time = current_time
+        return changed
+
+
+def make_gate(sampling, interval_seconds, min_interval=None, max_interval=None):
+    """ChangeGate for adaptive sampling around a fixed interval, or None for fixed sampling.
+
+    By default adaptive mode checks twice as often as the fixed interval and
+    samples at least every two intervals.
+    """
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode: {sampling}")
+    if sampling == "fixed":
+        return None
+    return ChangeGate(min_interval or interval_seconds / 2, max_interval or interval_seconds * 2)
+
+
+class Analyzer:
+    """Base class for per-frame analyzers driven by a FrameSource.
+
+    Subclasses receive only the frames they sampled and return events as
+    (time, payload) tuples. The source merges events from every analyzer
+    so they come out ordered by timestamp.
+    """
+    name = "analyzer"
+    interval_seconds = 1.0
+    # A ChangeGate makes sampling adaptive: frames are offered every
+    # gate.min_interval and only the ones it accepts reach process()
+    gate = None
+    # Set by the FrameSource before start()
+    video_path = None
+    # Inference batches whose results were lost this run; such a run is not cached
+    failed_batches = 0
+    # The BatchScheduler frames are submitted to, if the analyzer uses one
+    scheduler = None
+
+    def start(self, fps, total_frames):
+        """Prepare for a run. Return an error message to skip this analyzer."""
+        self.fps = fps
+        self.total_frames = total_frames
+        self.failed_batches = 0
+        return None
+
+    def frame_interval(self, fps):
+        """Number of source frames between two samples"""
+        interval = self.gate.min_interval if self.gate is not None else self.interval_seconds
+        return max(1, int(fps * interval))
+
+    def sampling_params(self):
+        """Cache parameters describing how frames are sampled"""
+        return self.gate.params() if self.gate is not None else {"mode": "fixed"}
+
+    def process(self, frame, frame_index):
+        """Analyze one sampled frame and return a list of (time, event) tuples"""
+        return []
+
+    def pending_time(self):
+        """Earliest timestamp still buffered inside the analyzer, if any"""
+        return None
+
+    def finish(self, frame_count):
+        """Flush buffered work at end of stream and return remaining events"""
+        return []
+
+    def cancel(self):
+        """The run was stopped early: drop frames still queued for the models"""
+        if self.scheduler is not None:
+            self.scheduler.cancel(self)
+
+    def cache_params(self):
+        """Parameters that change this analyzer's output, or None if it must not be cached"""
+        return None
+
+
+class FrameSource:
+    """Decodes a video once and fans sampled frames out to every registered analyzer.
+
+    Events are held in a heap and only released once no analyzer can still
+    produce an earlier one, so objects and emotions for minute 1 are emitted
+    long before the scene pass reaches the end of the file.
+    """
+
+    def __init__(self, video_path, strategy="auto"):
+        self.video_path = video_path
+        self.strategy = strategy
+        self.analyzers = []
+        self.replayed = []
+
+    def register(self, analyzer):
+        self.analyzers.append(analyzer)
+        return analyzer
+
+    def replay(self, events):
+        """Merge precomputed (time, event) tuples, e.g. from the cache, into the output"""
+        self.replayed.extend(events)
+
+    def run(self, should_stop=None):
+        """Generator that yields JSON events from all analyzers, ordered by time.
+
+        should_stop is polled before every sampled frame; when it returns True
+        the run ends without flushing the analyzers.
+        """
+        if not os.path.exists(self.video_path):
+            yield json.dumps({"error": "File not found"})
+            return
+
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            yield json.dumps({"error": "Could not open video"})
+            return
+
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        active = []
+        for analyzer in self.analyzers:
+            analyzer.video_path = self.video_path
+            error = analyzer.start(fps, total_frames)
+            if error:
+                yield json.dumps({"error": error})
+            else:
+                active.append((analyzer, analyzer.frame_interval(fps)))
+
+        heap = []
+        seq = 0
+
+        def push(events):
+            nonlocal seq
+            for event_time, event in events:
+                heapq.heappush(heap, (event_time, seq, event))
+                seq += 1
+
+        push(self.replayed)
+        sampler = FrameSampler(self.video_path, cap, fps, total_frames,
+                               [step for _, step in active] or [1], self.strategy)
+        frames = sampler.frames() if active else iter(())
+        samples = [0] * len(active)
+        run_started = decode_started = time.perf_counter()
+        decoded = False
+        try:
+            for frame_index, frame in frames:
+                FRAME_DECODE_SECONDS.observe(time.perf_counter() - decode_started, sampler.strategy)
+                if should_stop is not None and should_stop():
+                    return
+                features = None
+                for i, (analyzer, step) in enumerate(active):
+                    if frame_index % step == 0:
+                        if analyzer.gate is not None:
+                            # Computed once per frame and shared by every gated analyzer
+                            if features is None:
+                                features = change_features(frame)
+                            if not analyzer.gate.should_sample(features, frame_index / fps):
+                                continue
+                        push(analyzer.process(frame, frame_index))
+                        samples[i] += 1
+
+                # Release everything older than the oldest buffered frame
+                watermark = frame_index / fps
+                for analyzer, _ in active:
+                    pending = analyzer.pending_time()
+                    if pending is not None and pending < watermark:
+                        watermark = pending
+                while heap and heap[0][0] < watermark:
+                    yield _encode(heapq.heappop(heap)[2])
+                decode_started = time.perf_counter()
+            decoded = True
+        finally:
+            # Also stops an ffmpeg pipe if the run is cancelled or abandoned
+            if hasattr(frames, "close"):
+                frames.close()
+            cap.release()
+            if not decoded:
+                for analyzer, _ in active:
+                    analyzer.cancel()
+
+        for analyzer, _ in active:
+            push(analyzer.finish(sampler.frame_count))
+        elapsed = time.perf_counter() - run_started
+        for (analyzer, _), count in zip(active, samples):
+            if count and elapsed > 0:
+                ANALYSIS_FPS.observe(count / elapsed, analyzer.name)
+        while heap:
+            yield _encode(heapq.heappop(heap)[2])
@@ -0,0 +1,208 @@
+import heapq
+import json
+import os
+import threading
+import time
+
+from jobs import COMPLETE
+
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.webm', '.wmv', '.flv'}
+
+# Library files indexed at once; each one already runs several models
+INDEX_CONCURRENCY = 1
+# Files modified within this window are indexed before the rest of the library
+RECENT_SECONDS = 7 * 24 * 3600
+# How often idle-priority work re-checks whether interactive jobs are running
+IDLE_POLL_SECONDS = 2.0
+
+# Scheduling classes, lowest runs first
+CURRENT = 0
+RECENT = 1
+IDLE = 2
+PRIORITY_NAMES = {CURRENT: "current", RECENT: "recent", IDLE: "idle"}
+
+
+def find_videos(folder, recursive=True):
+    """Video files under a folder, matching the extensions the library scanner accepts"""
+    found = []
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS:
+                found.append(os.path.join(root, name))
+        if not recursive:
+            break
+    return sorted(found)
+
+
+class IndexStage:
+    """One step of indexing a file, run as a background job.
+
+    needed(path) says whether the stage still has work to do; submit(path)
+    starts (or joins) the job that does it.
+    """
+
+    def __init__(self, name, submit, needed=None):
+        self.name = name
+        self.submit = submit
+        self.needed = needed or (lambda path: True)
+
+
+class LibraryIndexer:
+    """Queues library files for indexing and runs them with bounded concurrency.
+
+    The currently opened video goes first, recently added files next, and
+    everything else only while no interactive job is running.
+    """
+
+    def __init__(self, job_manager, stages, max_concurrent=INDEX_CONCURRENCY):
+        self.job_manager = job_manager
+        self.stages = stages
+        self.max_concurrent = max_concurrent
+        self.condition = threading.Condition()
+        self.heap = []
+        self.files = {}
+        self.current = None
+        self.seq = 0
+        self.workers = []
+
+    def _priority(self, path):
+        if path == self.current:
+            return CURRENT, 0
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = 0
+        if mtime >= time.time() - RECENT_SECONDS:
+            # Newest first within the recent class
+            return RECENT, -mtime
+        self.seq += 1
+        return IDLE, self.seq
+
+    def _push(self, path):
+        priority, order = self._priority(path)
+        self.files[path]["priority"] = PRIORITY_NAMES[priority]
+        heapq.heappush(self.heap, (priority, order, path))
+
+    def enqueue(self, paths):
+        """Queue files for indexing; files already queued or running are left alone"""
+        queued = 0
+        with self.condition:
+            for path in paths:
+                entry = self.files.get(path)
+                if entry is not None and entry["state"] in ("queued", "running"):
+                    continue
+                self.files[path] = {
+                    "video_path": path,
+                    "state": "queued",
+                    "stage": None,
+                    "progress": 0,
+                    "job_id": None,
+                    "error": None,
+                    "queued_at": time.time(),
+                    "finished_at": None
+                }
+                self._push(path)
+                queued += 1
+            self.condition.notify_all()
+        self._start_workers()
+        return queued
+
+    def set_current(self, path):
+        """Mark the video the user has open so its queued indexing runs next"""
+        with self.condition:
+            self.current = path
+            entry = self.files.get(path)
+            if entry is not None and entry["state"] == "queued":
+                # The old heap entry is skipped when popped because the priority changed
+                self._push(path)
+                self.condition.notify_all()
+
+    def queue_depth(self):
+        with self.condition:
+            return sum(1 for entry in self.files.values() if entry["state"] == "queued")
+
+    def status(self):
+        with self.condition:
+            files = [dict(entry) for entry in self.files.values()]
+        counts = {}
+        for entry in files:
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+        return {"counts": counts, "current": self.current, "files": files}
+
+    def _start_workers(self):
+        with self.condition:
+            while len(self.workers) < self.max_concurrent:
+                worker = threading.Thread(target=self._work, name=f"indexer-{len(self.workers)}", daemon=True)
+                self.workers.append(worker)
+                worker.start()
+
+    def _next(self):
+        with self.condition:
+            while True:
+                while self.heap:
+                    priority, _, path = self.heap[0]
+                    entry = self.files.get(path)
+                    if entry is None or entry["state"] != "queued" or PRIORITY_NAMES[priority] != entry["priority"]:
+                        heapq.heappop(self.heap)  # stale
+                        continue
+                    if priority == IDLE and self.job_manager.busy():
+                        break
+                    heapq.heappop(self.heap)
+                    entry["state"] = "running"
+                    return path
+                self.condition.wait(IDLE_POLL_SECONDS if self.heap else None)
+
+    def _work(self):
+        while True:
+            path = self._next()
+            entry = self.files[path]
+            try:
+                state = self._index(path, entry)
+            except Exception as e:
+                entry["error"] = str(e)
+                state = "failed"
+            with self.condition:
+                entry["state"] = state
+                entry["finished_at"] = time.time()
+
+    def _index(self, path, entry):
+        if not os.path.exists(path):
+            entry["error"] = "File not found"
+            return "failed"
+        for stage in self.stages:
+            entry["stage"] = stage.name
+            entry["progress"] = 0
+            if not stage.needed(path):
+                continue
+            job = stage.submit(path)
+            entry["job_id"] = job.id
+            status = self._follow(job, entry)
+            if status != COMPLETE:
+                entry["error"] = f"{stage.name} {status}"
+                return status
+        entry["stage"] = None
+        entry["progress"] = 100
+        return "done"
+
+    def _follow(self, job, entry):
+        """Wait for a job while recording its progress; being subscribed keeps it from being orphaned"""
+        self.job_manager.attach(job)
+        try:
+            index = 0
+            while True:
+                with job.condition:
+                    if index >= len(job.events) and not job.finished:
+                        job.condition.wait(IDLE_POLL_SECONDS)
+                    batch = job.events[index:]
+                    finished = job.finished
+                index += len(batch)
+                for data in batch:
+                    event = json.loads(data)
+                    if event.get("type") == "progress":
+                        entry["progress"] = event.get("percent", entry["progress"])
+                    elif "time" in event:
+                        entry["position"] = event["time"]
+                if finished and index >= len(job.events):
+                    return job.status
+        finally:
+            self.job_manager.detach(job)
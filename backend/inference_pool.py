@@ -0,0 +1,499 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from metrics import BATCH_FRAMES, BATCH_STREAMS, INFERENCE_ITEMS, INFERENCE_SECONDS, QUEUE_WAIT_SECONDS
+
+# Worker processes that own the vision models. 0 runs every model, whisper included, inside the API process.
+DEFAULT_INFERENCE_WORKERS = max(0, min(2, (os.cpu_count() or 1) - 1))
+INFERENCE_WORKERS = int(os.environ.get("NEURALPLAY_INFERENCE_WORKERS", DEFAULT_INFERENCE_WORKERS))
+
+# Frames larger than this are scaled down before they enter the ring; every
+# model resizes to far less anyway (YOLO 640, ResNet 224, face prefilter 320)
+MAX_FRAME_SIZE = (1280, 720)
+# Batches one analyzer keeps in flight before it waits for the oldest
+MAX_IN_FLIGHT = 2
+
+KINDS = ("objects", "scenes", "emotions")
+
+# Most frames the scheduler puts in one model call, per model. Each model's
+# scheduler keeps up to one batch per worker outstanding.
+MAX_BATCH = {"objects": 16, "scenes": 16, "emotions": 16}
+
+
+def ring_slots(workers):
+    """Frame ring slots for every batch all schedulers can have outstanding at once.
+
+    A scheduler then never waits for ring space, which another model's
+    batches could otherwise hold. Free slots are reused most recently
+    freed first, so only the pages of slots actually needed become resident.
+    """
+    return max(1, workers) * sum(MAX_BATCH.values())
+# How long the first queued frames wait for others to fill the batch
+MAX_WAIT_SECONDS = 0.005
+
+
+class FrameRing:
+    """Fixed-size slots in one shared memory block that frames are copied into.
+
+    Only the API process writes. A batch takes all its slots at once, so
+    half-filled batches can never hold the ring hostage, and the slots are
+    freed when the worker's result comes back.
+    """
+
+    def __init__(self, slots, max_size=MAX_FRAME_SIZE):
+        from multiprocessing import shared_memory
+        self.slots = slots
+        self.max_size = max_size
+        self.slot_bytes = max_size[0] * max_size[1] * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_bytes)
+        self.free = list(range(slots))
+        self.condition = threading.Condition()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def put_batch(self, frames):
+        """Copy frames into free slots, waiting for space; returns [(slot, shape, scale)]"""
+        if len(frames) > self.slots:
+            raise ValueError(f"Batch of {len(frames)} frames does not fit in {self.slots} slots")
+        with self.condition:
+            while len(self.free) < len(frames):
+                self.condition.wait()
+            slots = [self.free.pop() for _ in frames]
+        placed = []
+        for slot, frame in zip(slots, frames):
+            height, width = frame.shape[:2]
+            scale = min(1.0, self.max_size[0] / width, self.max_size[1] / height)
+            if scale < 1.0:
+                frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+            view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+            np.copyto(view, frame)
+            placed.append((slot, frame.shape, scale))
+        return placed
+
+    def release(self, slots):
+        with self.condition:
+            self.free.extend(slots)
+            self.condition.notify_all()
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+# ---------- WORKER SIDE ----------
+
+_worker_shm = None
+_worker_slot_bytes = 0
+
+
+def _init_worker(shm_name, slot_bytes, threads):
+    global _worker_shm, _worker_slot_bytes
+    # Before torch/TF are imported, so each worker uses its share of the cores
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTEROP_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[var] = str(threads)
+    from multiprocessing import shared_memory
+    # Spawned workers share the API process's resource tracker, which unlinks the block once
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_slot_bytes = slot_bytes
+
+
+def _frames(placed):
+    return [np.ndarray(shape, dtype=np.uint8, buffer=_worker_shm.buf, offset=slot * _worker_slot_bytes)
+            for slot, shape, _ in placed]
+
+
+def probe(kind):
+    """Load the model for kind in this process; a truthy value if it is usable"""
+    if kind == "objects":
+        from object_detection import get_model
+        return get_model() is not None
+    if kind == "scenes":
+        from scene_detection import get_feature_extractor
+        try:
+            return get_feature_extractor() is not None
+        except Exception as e:
+            print(f"[InferencePool] ResNet unavailable, scenes use histograms: {e}")
+            return False
+    if kind == "emotions":
+        from emotion_recognition import get_deepface, get_emotion_model, get_face_detector
+        if get_deepface() is None:
+            return False
+        # Which path classify_frames takes here, since it changes the results
+        return "batched" if get_face_detector() is not None and get_emotion_model() is not None else "deepface"
+    raise ValueError(f"Unknown inference kind: {kind}")
+
+
+def run_batch(kind, frames, scales=None):
+    """Run the model for kind on a list of frames in this process.
+
+    objects: ([(cls, conf, xyxy)] per frame, class names); scenes: an
+    embedding row per frame; emotions: a list of labels per frame.
+    """
+    if kind == "objects":
+        from object_detection import get_model, predict_batch
+        model = get_model()
+        predictions = predict_batch(model, frames)
+        if scales is not None:
+            # Boxes back in the coordinates of the original frames
+            predictions = [(cls, conf, xyxy / scale) for (cls, conf, xyxy), scale in zip(predictions, scales)]
+        return predictions, dict(model.names)
+    if kind == "scenes":
+        from scene_detection import embed_frames, get_feature_extractor
+        return embed_frames(get_feature_extractor(), frames)
+    if kind == "emotions":
+        from emotion_recognition import classify_frames
+        return classify_frames(frames)
+    raise ValueError(f"Unknown inference kind: {kind}")
+
+
+def split_result(kind, result, start, end):
+    """The part of a batch result that belongs to frames start:end"""
+    if kind == "objects":
+        predictions, names = result
+        return predictions[start:end], names
+    return result[start:end]
+
+
+def _run(kind, placed):
+    """Run one batch on frames read straight from shared memory; returns (result, seconds)"""
+    started = time.perf_counter()
+    result = run_batch(kind, _frames(placed), [scale for _, _, scale in placed])
+    return result, time.perf_counter() - started
+
+
+# ---------- API PROCESS SIDE ----------
+
+class InferencePool:
+    """Worker processes that each own their models, fed through a shared FrameRing.
+
+    submit() copies a batch of frames into the ring and returns a Future for
+    the model output; only slot numbers and shapes are pickled. When a worker
+    dies (e.g. killed for running out of memory) the executor is broken for
+    good, so it is replaced and the models are probed again.
+    """
+
+    def __init__(self, workers, slots=None, max_size=MAX_FRAME_SIZE):
+        self.workers = workers
+        self.ring = FrameRing(slots or ring_slots(workers), max_size)
+        self.threads = max(1, (os.cpu_count() or 1) // workers)
+        self.availability = {}
+        self.lock = threading.Lock()
+        self.executor = self._start_executor()
+        print(f"[InferencePool] Started {workers} inference worker processes")
+
+    def _start_executor(self):
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker,
+                                   initargs=(self.ring.name, self.ring.slot_bytes, self.threads))
+
+    def _restart(self, broken):
+        """Replace a broken executor, once, however many of its batches noticed"""
+        with self.lock:
+            if self.executor is not broken:
+                return
+            print("[InferencePool] A worker process died, restarting the workers")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._start_executor()
+            self.availability.clear()
+
+    def _submit(self, fn, *args):
+        """executor.submit, on a fresh executor if the current one is already broken"""
+        executor = self.executor
+        try:
+            return executor, executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._restart(executor)
+            executor = self.executor
+            return executor, executor.submit(fn, *args)
+
+    def available(self, kind):
+        """Whether the model for kind loads in a worker (the probe's result); probed once, which also warms it up"""
+        with self.lock:
+            if kind in self.availability:
+                return self.availability[kind]
+        try:
+            executor, future = self._submit(probe, kind)
+            usable = future.result()
+        except BrokenProcessPool as e:
+            # Not cached: the next call probes the restarted workers
+            print(f"[InferencePool] Could not probe {kind}: {e}")
+            self._restart(executor)
+            return False
+        except Exception as e:
+            print(f"[InferencePool] Could not probe {kind}: {e}")
+            usable = False
+        with self.lock:
+            self.availability[kind] = usable
+        return usable
+
+    def submit(self, kind, frames):
+        placed = self.ring.put_batch(frames)
+        slots = [slot for slot, _, _ in placed]
+        outer = Future()
+        try:
+            executor, inner = self._submit(_run, kind, placed)
+        except Exception:
+            self.ring.release(slots)
+            raise
+
+        def done(inner):
+            self.ring.release(slots)
+            try:
+                result, elapsed = inner.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._restart(executor)
+                outer.set_exception(e)
+                return
+            INFERENCE_SECONDS.observe(elapsed, kind)
+            INFERENCE_ITEMS.inc(kind, amount=len(slots))
+            outer.set_result(result)
+
+        inner.add_done_callback(done)
+        return outer
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.ring.close()
+
+
+class BatchScheduler:
+    """Gathers frames from every running analysis into micro-batches for one model.
+
+    Analyses submit their frames per stream (normally the analyzer itself).
+    A batch is started once it is full or its oldest frames have waited
+    MAX_WAIT_SECONDS. Streams take turns, one request each, so a long library
+    job cannot crowd out a short request, and requests for the video that is
+    currently playing go first. Each request's Future gets its own slice of
+    the batch result.
+
+    With an InferencePool the batches run in the workers, as many at a time
+    as there are workers; otherwise they run on the scheduler thread.
+    """
+
+    def __init__(self, kind, pool=None, max_batch=None, max_wait=MAX_WAIT_SECONDS):
+        self.kind = kind
+        self.pool = pool
+        self.max_batch = max_batch or MAX_BATCH[kind]
+        self.max_wait = max_wait
+        self.queues = {}      # stream -> deque of (video_path, frames, future, enqueued)
+        self.order = deque()  # streams with queued requests, next turn first
+        self.queued_frames = 0
+        self.condition = threading.Condition()
+        self.outstanding = threading.Semaphore(pool.workers if pool is not None else 1)
+        self.availability = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._loop, name=f"batch-{kind}", daemon=True)
+        self.thread.start()
+
+    def available(self):
+        """The model's probe result: falsy if it cannot be loaded"""
+        if self.pool is not None:
+            return self.pool.available(self.kind)
+        if self.availability is None:
+            self.availability = probe(self.kind)
+        return self.availability
+
+    def submit(self, stream, video_path, frames):
+        future = Future()
+        with self.condition:
+            if stream not in self.queues:
+                self.queues[stream] = deque()
+                self.order.append(stream)
+            self.queues[stream].append((video_path, frames, future, time.perf_counter()))
+            self.queued_frames += len(frames)
+            self.condition.notify()
+        return future
+
+    def cancel(self, stream):
+        """Drop the requests of a stream that are still queued, e.g. because its analysis was cancelled"""
+        with self.condition:
+            queue = self.queues.pop(stream, None)
+            if queue is None:
+                return
+            self.order.remove(stream)
+            for _, frames, future, _ in queue:
+                self.queued_frames -= len(frames)
+                future.cancel()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def _take(self):
+        """Requests for the next batch, whole requests only, taking turns across streams"""
+        batch = []
+        count = 0
+        streams = set()
+        while self.order:
+            # The playing video's requests jump the queue
+            stream = next((s for s in self.order if self.queues[s][0][0] == _current_video), self.order[0])
+            queue = self.queues[stream]
+            if batch and count + len(queue[0][1]) > self.max_batch:
+                break
+            request = queue.popleft()
+            batch.append(request)
+            count += len(request[1])
+            streams.add(stream)
+            self.order.remove(stream)
+            if queue:
+                self.order.append(stream)
+            else:
+                del self.queues[stream]
+            if count >= self.max_batch:
+                break
+        self.queued_frames -= count
+        BATCH_STREAMS.observe(len(streams), self.kind)
+        return batch
+
+    def _loop(self):
+        while True:
+            # Wait for a free worker first; frames keep accumulating meanwhile
+            self.outstanding.acquire()
+            with self.condition:
+                while not self.closed:
+                    if self.order:
+                        waited = time.perf_counter() - min(self.queues[s][0][3] for s in self.order)
+                        if self.queued_frames >= self.max_batch or waited >= self.max_wait:
+                            break
+                        self.condition.wait(self.max_wait - waited)
+                    else:
+                        self.condition.wait()
+                if self.closed:
+                    return
+                batch = self._take()
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        frames = [frame for _, request_frames, _, _ in batch for frame in request_frames]
+        BATCH_FRAMES.observe(len(frames), self.kind)
+        for _, _, _, enqueued in batch:
+            QUEUE_WAIT_SECONDS.observe(started - enqueued, self.kind)
+
+        def deliver(result_future):
+            self.outstanding.release()
+            try:
+                result = result_future.result()
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                return
+            start = 0
+            for _, request_frames, future, _ in batch:
+                future.set_result(split_result(self.kind, result, start, start + len(request_frames)))
+                start += len(request_frames)
+
+        if self.pool is not None:
+            try:
+                result_future = self.pool.submit(self.kind, frames)
+            except Exception as e:
+                result_future = Future()
+                result_future.set_exception(e)
+        else:
+            result_future = Future()
+            try:
+                result_future.set_result(run_batch(self.kind, frames))
+            except Exception as e:
+                result_future.set_exception(e)
+        result_future.add_done_callback(deliver)
+
+
+class InFlight:
+    """Batches an analyzer has submitted, consumed in submission order"""
+
+    def __init__(self, limit=MAX_IN_FLIGHT):
+        self.limit = limit
+        self.batches = deque()
+
+    def add(self, context, future):
+        self.batches.append((context, future))
+
+    def earliest(self):
+        return self.batches[0][0] if self.batches else None
+
+    def take(self, wait_all=False):
+        """(context, future) pairs that are finished, oldest first.
+
+        Waits for the oldest batch while more than `limit` are in flight, or
+        for all of them with wait_all.
+        """
+        ready = []
+        while self.batches:
+            context, future = self.batches[0]
+            if not (future.done() or wait_all or len(self.batches) > self.limit):
+                break
+            future.exception()  # waits without raising
+            self.batches.popleft()
+            ready.append((context, future))
+        return ready
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_schedulers = {}
+_current_video = None
+
+
+def get_inference_pool():
+    """The shared inference pool, or None when models run in the API process"""
+    global _pool
+    if INFERENCE_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = InferencePool(INFERENCE_WORKERS)
+            except Exception as e:
+                print(f"[InferencePool] Could not start workers, running models in-process: {e}")
+                return None
+        return _pool
+
+
+def ring_slots_in_use():
+    """Frame ring slots holding frames a worker has not finished with"""
+    pool = _pool
+    if pool is None:
+        return 0
+    with pool.ring.condition:
+        return pool.ring.slots - len(pool.ring.free)
+
+
+def get_scheduler(kind):
+    """The BatchScheduler every analysis uses for the model of kind"""
+    pool = get_inference_pool()
+    with _pool_lock:
+        scheduler = _schedulers.get(kind)
+        if scheduler is None:
+            scheduler = _schedulers[kind] = BatchScheduler(kind, pool)
+        return scheduler
+
+
+def set_current_video(video_path):
+    """Frames of this video are batched ahead of every other analysis"""
+    global _current_video
+    _current_video = video_path
+
+
+def shutdown_inference_pool():
+    global _pool
+    with _pool_lock:
+        for scheduler in _schedulers.values():
+            scheduler.close()
+        _schedulers.clear()
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
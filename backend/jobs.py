@@ -0,0 +1,245 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Analysis jobs running at once; each one already keeps several cores busy
+MAX_JOB_WORKERS = 2
+# Library indexing jobs running at once, on threads of their own so they never hold up interactive jobs
+MAX_BACKGROUND_JOB_WORKERS = 1
+# How long finished jobs stay around so clients can resume their event stream
+JOB_RETENTION_SECONDS = 600
+# Seconds between idle ticks while a subscriber waits for events
+TICK_SECONDS = 1.0
+# How long a job keeps running after its last subscriber left, to allow reconnects
+CANCEL_GRACE_SECONDS = 5.0
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """A unit of analysis work whose events are kept so any number of clients can follow it"""
+
+    def __init__(self, kind, key, video_path, cancel_when_orphaned=True):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.video_path = video_path
+        self.cancel_when_orphaned = cancel_when_orphaned
+        self.status = QUEUED
+        self.events = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        self.cancel_event = threading.Event()
+        self.waiters = []
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def is_cancelled(self):
+        """Polled by the detector loops between samples"""
+        return self.cancel_event.is_set()
+
+    def _wake(self):
+        for loop, wake in self.waiters:
+            loop.call_soon_threadsafe(wake.set)
+
+    def append(self, data):
+        with self.condition:
+            self.events.append(data)
+            self.condition.notify_all()
+            self._wake()
+
+    def finish(self, status):
+        with self.condition:
+            self.status = status
+            self.finished_at = time.time()
+            self.condition.notify_all()
+            self._wake()
+
+    def event_id(self, index):
+        return f"{self.id}:{index}"
+
+    async def subscribe(self, after=-1):
+        """Yield (event_id, data) for every event after index `after`, waiting for new ones.
+
+        Yields (None, None) every TICK_SECONDS while idle so callers can check
+        for a disconnected client, and returns once the job has finished.
+        """
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        waiter = (loop, wake)
+        with self.condition:
+            self.waiters.append(waiter)
+        index = after + 1
+        try:
+            while True:
+                with self.condition:
+                    batch = self.events[index:]
+                    finished = self.finished
+                    if not batch and not finished:
+                        wake.clear()
+                if batch:
+                    for data in batch:
+                        yield self.event_id(index), data
+                        index += 1
+                    continue
+                if finished:
+                    return
+                try:
+                    await asyncio.wait_for(wake.wait(), TICK_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None, None
+        finally:
+            with self.condition:
+                self.waiters.remove(waiter)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "video_path": self.video_path,
+            "status": self.status,
+            "events": len(self.events),
+            "subscribers": self.subscribers,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+def parse_event_id(event_id):
+    """Split a 'job_id:index' SSE event id, returning (None, -1) if it is malformed"""
+    if not event_id or ":" not in event_id:
+        return None, -1
+    job_id, _, index = event_id.rpartition(":")
+    try:
+        return job_id, int(index)
+    except ValueError:
+        return None, -1
+
+
+class JobManager:
+    """Runs jobs on bounded thread pools and deduplicates identical concurrent requests.
+
+    Jobs that outlive their subscribers (library indexing) get a pool of
+    their own, so a long background job never keeps an interactive one
+    waiting for a thread.
+    """
+
+    def __init__(self, max_workers=MAX_JOB_WORKERS, max_background_workers=MAX_BACKGROUND_JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.background_executor = ThreadPoolExecutor(max_workers=max_background_workers,
+                                                      thread_name_prefix="background-job")
+        self.jobs = {}
+        self.by_key = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, key, video_path, producer, cancel_when_orphaned=True):
+        """Start producer(job) as a job, or return the running job with the same key.
+
+        producer returns an iterator of JSON event strings and should poll
+        job.is_cancelled() between units of work. Jobs with
+        cancel_when_orphaned are cancelled once nobody is subscribed to them.
+        """
+        with self.lock:
+            self._prune()
+            job = self.by_key.get(key)
+            if job is not None and not job.finished and not job.is_cancelled():
+                return job
+            job = Job(kind, key, video_path, cancel_when_orphaned)
+            self.jobs[job.id] = job
+            self.by_key[key] = job
+        executor = self.executor if cancel_when_orphaned else self.background_executor
+        executor.submit(self._run, job, producer)
+        return job
+
+    def _run(self, job, producer):
+        if job.is_cancelled():
+            job.finish(CANCELLED)
+            return
+        job.status = RUNNING
+        events = producer(job)
+        try:
+            for data in events:
+                job.append(data)
+                if job.is_cancelled():
+                    break
+        except Exception as e:
+            job.append(json.dumps({"type": "error", "error": f"Job failed: {str(e)}"}))
+            job.finish(FAILED)
+            return
+        finally:
+            # Stops decoders and worker processes held by the generator
+            events.close()
+        if job.is_cancelled():
+            job.append(json.dumps({"type": "cancelled", "message": "Job cancelled"}))
+            job.finish(CANCELLED)
+        else:
+            job.finish(COMPLETE)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+        return job
+
+    def attach(self, job):
+        with self.lock:
+            job.subscribers += 1
+
+    def detach(self, job):
+        """Drop a subscriber; orphaned jobs are cancelled after a grace period"""
+        with self.lock:
+            job.subscribers -= 1
+            orphaned = job.subscribers == 0 and job.cancel_when_orphaned and not job.finished
+        if orphaned:
+            timer = threading.Timer(CANCEL_GRACE_SECONDS, self._cancel_if_orphaned, (job,))
+            timer.daemon = True
+            timer.start()
+
+    def _cancel_if_orphaned(self, job):
+        with self.lock:
+            if job.subscribers > 0 or job.finished:
+                return
+        job.cancel_event.set()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def busy(self):
+        """True while a job started by an interactive client is still running"""
+        with self.lock:
+            return any(job.cancel_when_orphaned and not job.finished for job in self.jobs.values())
+
+    def status_counts(self):
+        """Number of retained jobs per (status, kind)"""
+        counts = {}
+        with self.lock:
+            for job in self.jobs.values():
+                counts[(job.status, job.kind)] = counts.get((job.status, job.kind), 0) + 1
+        return counts
+
+    def list_jobs(self):
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self.jobs[job_id]
+                if self.by_key.get(job.key) is job:
+                    del self.by_key[job.key]
+
+
+job_manager = JobManager()
@@ -1,7 +1,8 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 import uvicorn
+import json
 import os
 
 app = FastAPI()
@@ -22,10 +23,132 @@ from database import init_db
 @app.on_event("startup")
 def on_startup():
     init_db()
+    if WARMUP_ENABLED:
+        model_warmup.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    from transcription import shutdown_transcription_pool
+    shutdown_inference_pool()
+    shutdown_transcription_pool()
+
+# ---------- MODEL WARM-UP ----------
+
+from inference_pool import get_scheduler, ring_slots_in_use, set_current_video, shutdown_inference_pool
+from warmup import ModelWarmup, WARMUP_ENABLED
+
+# Vision models load where their scheduler runs them: in an inference worker or in this process
+
+def _load_resnet():
+    return get_scheduler("scenes").available() or None
+
+def _load_yolo():
+    return get_scheduler("objects").available() or None
+
+def _load_whisper():
+    # Whisper runs in its own worker processes, which load the model here
+    from transcription import warm_up_transcription_pool
+    return warm_up_transcription_pool()
+
+def _load_deepface():
+    # "deepface" when only the full-frame path works, which is still usable
+    return get_scheduler("emotions").available() or None
+
+# Cheapest first so the common detectors are warm as early as possible
+model_warmup = ModelWarmup({
+    "resnet": _load_resnet,
+    "yolo": _load_yolo,
+    "whisper": _load_whisper,
+    "deepface": _load_deepface,
+})
+
+@app.get("/ready")
+def api_ready():
+    """Per-model load state: pending, loading, ready, unavailable or failed"""
+    return model_warmup.status()
+
+# ---------- BACKGROUND JOBS ----------
+
+from contextlib import aclosing
+from jobs import job_manager, parse_event_id, CANCELLED, FAILED, TICK_SECONDS
+
+KEEPALIVE_SECONDS = 15
+
+def find_or_submit_job(kind, key, video_path, producer, last_event_id=None, cancel_when_orphaned=True):
+    """Resume the job a reconnecting client was following, join an identical running job, or start one.
+
+    A job that failed or was cancelled, e.g. after its client stayed away
+    past the grace period, is not resumed; the work starts over instead.
+    """
+    job_id, _ = parse_event_id(last_event_id)
+    job = job_manager.get(job_id) if job_id else None
+    if job is None or job.key != key or job.status in (FAILED, CANCELLED) or job.is_cancelled():
+        job = job_manager.submit(kind, key, video_path, producer, cancel_when_orphaned)
+    return job
+
+def job_event_stream(request, job, last_event_id=None):
+    """SSE response following a job, resuming after Last-Event-ID when it belongs to this job.
+
+    Each event carries an "id: <job_id>:<index>" line so EventSource sends it
+    back on reconnect. The job id is announced in a named "job" event. When
+    the client disconnects the subscription ends, and a job nobody follows
+    any more is cancelled.
+    """
+    job_id, after = parse_event_id(last_event_id)
+    if job_id != job.id:
+        after = -1
+
+    async def generate():
+        job_manager.attach(job)
+        try:
+            yield f"event: job\ndata: {json.dumps({'job_id': job.id})}\n\n"
+            idle = 0.0
+            async with aclosing(job.subscribe(after)) as events:
+                async for event_id, data in events:
+                    if event_id is not None:
+                        idle = 0.0
+                        yield f"id: {event_id}\ndata: {data}\n\n"
+                        continue
+                    if await request.is_disconnected():
+                        break
+                    idle += TICK_SECONDS
+                    if idle >= KEEPALIVE_SECONDS:
+                        idle = 0.0
+                        yield ": keep-alive\n\n"
+        finally:
+            job_manager.detach(job)
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+@app.get("/jobs")
+def api_list_jobs():
+    return job_manager.list_jobs()
+
+@app.get("/jobs/{job_id}")
+def api_get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def api_job_events(request: Request, job_id: str, last_event_id: str = Header(None)):
+    job = job_manager.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return job_event_stream(request, job, last_event_id)
+
+@app.post("/jobs/{job_id}/cancel")
+def api_cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return job.to_dict()
 
 from transcription import transcribe_video, transcribe_video_streaming
-from database import SessionLocal, Video, Transcript
+from database import SessionLocal, Video, Transcript, replace_transcript, search_transcripts
 from pydantic import BaseModel
+from typing import List, Optional
 
 class TranscribeRequest(BaseModel):
     video_path: str
@@ -36,7 +159,9 @@ def api_transcribe(video_path: str):
 
 # Streaming transcription endpoint - streams segments as they're ready
 @app.get("/transcribe_stream")
-def api_transcribe_stream(video_path: str):
+async def api_transcribe_stream(request: Request, video_path: str, persist: bool = True, workers: int = 1,
+                                playback_position: float = 0.0, max_memory_mb: int = None, vad: bool = True,
+                                last_event_id: str = Header(None)):
     """Stream transcription results progressively via SSE.
     
     This allows subtitles to appear within ~30 seconds instead of waiting
@@ -47,67 +172,113 @@ def api_transcribe_stream(video_path: str):
     - {"type": "progress", "percent": N, "message": "..."}
     - {"type": "error", "error": "..."}
     - {"type": "complete"}
+    
+    With persist=true (the default) segments are written to the database as
+    they are produced, so the client does not need to call /store_transcript.
+    workers > 1 transcribes chunks in parallel processes; max_memory_mb caps
+    how many whisper workers are started. The segments of the chunk under
+    playback_position come first, all others follow in timestamp order.
+    vad=true skips non-speech and cuts chunks at pauses.
+    
+    Runs as a background job shared by identical requests; reconnecting
+    with Last-Event-ID resumes after the last event received. The job is
+    cancelled shortly after the last client disconnects.
     """
-    def generate():
-        for data in transcribe_video_streaming(video_path):
-            yield f"data: {data}\n\n"
+    library_indexer.set_current(video_path)
+    job = submit_transcription_job(video_path, persist, workers, playback_position, max_memory_mb, vad,
+                                   last_event_id=last_event_id)
+    return job_event_stream(request, job, last_event_id)
+
+def submit_transcription_job(video_path, persist=True, workers=1, playback_position=0.0,
+                             max_memory_mb=None, vad=True, last_event_id=None, cancel_when_orphaned=True):
+    def produce(job):
+        return transcribe_video_streaming(video_path, persist=persist, workers=workers,
+                                          playback_position=playback_position,
+                                          max_memory_mb=max_memory_mb, vad=vad,
+                                          should_stop=job.is_cancelled)
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    return find_or_submit_job("transcribe", ("transcribe", video_path, persist, vad),
+                              video_path, produce, last_event_id, cancel_when_orphaned)
 
 @app.post("/store_transcript")
-async def store_transcript(video_path: str, data: dict):
-    session = SessionLocal()
-    video = session.query(Video).filter(Video.path == video_path).first()
-    if not video:
-        video = Video(path=video_path, name=os.path.basename(video_path))
-        session.add(video)
-        session.commit()
-        session.refresh(video)
-    
-    session.query(Transcript).filter(Transcript.video_id == video.id).delete()
-    
-    for seg in data.get('segments', []):
-        t = Transcript(video_id=video.id, text=seg['text'], start_time=seg['start'], end_time=seg['end'])
-        session.add(t)
-    
-    session.commit()
-    session.close()
-    return {"status": "ok"}
+def store_transcript(video_path: str, data: dict):
+    try:
+        count = replace_transcript(video_path, data.get('segments', []))
+    except Exception as e:
+        return {"error": f"Could not store transcript: {str(e)}"}
+    return {"status": "ok", "segments": count}
 
 # Search endpoint
 @app.get("/search_transcript")
-def search_transcript(query: str):
+def search_transcript(query: str, video_path: str = None, limit: int = 50, offset: int = 0):
+    """Ranked full-text search over transcript segments.
+
+    Supports "quoted phrases" and prefix* terms. Pass video_path to search
+    a single video; results carry the video path and a highlighted snippet.
+    """
     session = SessionLocal()
-    results = session.query(Transcript).filter(Transcript.text.contains(query)).all()
-    output = [{"start": t.start_time, "end": t.end_time, "text": t.text} for t in results]
-    session.close()
-    return output
+    try:
+        video_id = None
+        if video_path:
+            video = session.query(Video).filter(Video.path == video_path).first()
+            if not video:
+                return []
+            video_id = video.id
+        return search_transcripts(session, query, video_id, max(1, min(limit, 500)), max(0, offset))
+    finally:
+        session.close()
 
 # ---------- STREAMING ENDPOINTS ----------
 
-from scene_detection import detect_scenes, detect_scenes_streaming
-from object_detection import detect_objects, detect_objects_streaming
-from emotion_recognition import detect_emotions, detect_emotions_streaming
+from analysis_cache import run_analysis
+from scene_detection import detect_scenes, SceneAnalyzer
+from object_detection import (detect_objects, detect_object_intervals, ObjectAnalyzer, ObjectIntervalAnalyzer,
+                              DEFAULT_BATCH_SIZE)
+from emotion_recognition import detect_emotions, EmotionAnalyzer
+from frame_source import SAMPLING_MODES
+
+# Per-sample label lists, or one event per tracked appearance
+OBJECT_OUTPUTS = {"labels": ObjectAnalyzer, "intervals": ObjectIntervalAnalyzer}
 
 # SSE Streaming endpoint for all analysis at once
+def analyze_video(video_path, should_stop=None, sampling="fixed", objects="labels"):
+    # Decode the video once and fan frames out to every analyzer,
+    # replaying results that are already cached for this file
+    analyzers = [SceneAnalyzer(0.85), OBJECT_OUTPUTS[objects](2.0, sampling=sampling),
+                 EmotionAnalyzer(3.0, sampling=sampling)]
+    yield from run_analysis(video_path, analyzers, should_stop=should_stop)
+    if should_stop is None or not should_stop():
+        yield json.dumps({"type": "complete", "message": "All analysis complete"})
+
 @app.get("/analyze_stream")
-def analyze_stream(video_path: str):
-    def generate():
-        # Run scene detection
-        for data in detect_scenes_streaming(video_path, 0.85):
-            yield f"data: {data}\n\n"
-        
-        # Run object detection
-        for data in detect_objects_streaming(video_path, 2.0):
-            yield f"data: {data}\n\n"
-        
-        # Run emotion detection
-        for data in detect_emotions_streaming(video_path, 3.0):
-            yield f"data: {data}\n\n"
-        
-        yield f"data: {{\"type\": \"complete\", \"message\": \"All analysis complete\"}}\n\n"
-    
-    return StreamingResponse(generate(), media_type="text/event-stream")
+async def analyze_stream(request: Request, video_path: str, sampling: str = "fixed", objects: str = "labels",
+                         last_event_id: str = Header(None)):
+    """Stream scene, object and emotion events via SSE from a background job.
+
+    sampling="fixed" (the default) samples objects every 2s and emotions
+    every 3s; "adaptive" runs those models only when the picture changed
+    (every 1-4s and 1.5-6s).
+    objects="intervals" sends one object_interval event per tracked
+    appearance instead of an object event per sample.
+
+    Identical concurrent requests share one job; reconnecting with
+    Last-Event-ID resumes after the last event received. The job is
+    cancelled shortly after the last client disconnects.
+    """
+    if sampling not in SAMPLING_MODES:
+        return {"error": f"Unknown sampling mode: {sampling}"}
+    if objects not in OBJECT_OUTPUTS:
+        return {"error": f"Unknown object output: {objects}"}
+    library_indexer.set_current(video_path)
+    set_current_video(video_path)
+    job = submit_analysis_job(video_path, last_event_id, sampling=sampling, objects=objects)
+    return job_event_stream(request, job, last_event_id)
+
+def submit_analysis_job(video_path, last_event_id=None, cancel_when_orphaned=True, sampling="fixed",
+                        objects="labels"):
+    return find_or_submit_job("analyze", ("analyze", video_path, sampling, objects), video_path,
+                              lambda job: analyze_video(video_path, job.is_cancelled, sampling, objects),
+                              last_event_id, cancel_when_orphaned)
 
 # Non-streaming endpoints (kept for backwards compatibility)
 @app.post("/detect_scenes")
@@ -115,79 +286,230 @@ def api_detect_scenes(video_path: str):
     return detect_scenes(video_path)
 
 @app.post("/detect_objects")
-def api_detect_objects(video_path: str):
-    return detect_objects(video_path)
+def api_detect_objects(video_path: str, batch_size: int = DEFAULT_BATCH_SIZE, sampling: str = "fixed",
+                       min_interval: float = None, max_interval: float = None):
+    if sampling not in SAMPLING_MODES:
+        return {"error": f"Unknown sampling mode: {sampling}"}
+    return detect_objects(video_path, batch_size=batch_size, sampling=sampling,
+                          min_interval=min_interval, max_interval=max_interval)
+
+@app.post("/detect_object_intervals")
+def api_detect_object_intervals(video_path: str, sampling: str = "fixed", min_interval: float = None,
+                                max_interval: float = None):
+    """Track objects across samples and return when each one is visible"""
+    if sampling not in SAMPLING_MODES:
+        return {"error": f"Unknown sampling mode: {sampling}"}
+    return detect_object_intervals(video_path, sampling=sampling, min_interval=min_interval,
+                                   max_interval=max_interval)
+
+from analysis_cache import find_object_intervals
+
+@app.get("/object_intervals")
+def api_object_intervals(video_path: str, label: Optional[str] = None):
+    """When stored objects are visible, e.g. label=dog for every appearance of a dog"""
+    intervals = find_object_intervals(video_path, label)
+    if intervals is None:
+        return {"error": "Video has not been tracked. Run /detect_object_intervals or "
+                         "/analyze_stream?objects=intervals first."}
+    return {"intervals": intervals}
+
+from detection_store import query_detections
+
+@app.get("/detections")
+def api_detections(video_path: str, start: float = 0.0, end: Optional[float] = None, min_conf: float = 0.0):
+    """Stored YOLO boxes between start and end seconds, as parallel arrays for drawing overlays"""
+    return query_detections(video_path, start, end, min_conf)
 
 @app.post("/detect_emotions")
-def api_detect_emotions(video_path: str):
-    return detect_emotions(video_path)
+def api_detect_emotions(video_path: str, sampling: str = "fixed", min_interval: float = None,
+                        max_interval: float = None):
+    if sampling not in SAMPLING_MODES:
+        return {"error": f"Unknown sampling mode: {sampling}"}
+    return detect_emotions(video_path, sampling=sampling, min_interval=min_interval, max_interval=max_interval)
+
+# ---------- LIBRARY INDEXING ----------
+
+from indexer import LibraryIndexer, IndexStage, find_videos
+from database import has_transcript
+
+library_indexer = LibraryIndexer(job_manager, [
+    IndexStage("transcription",
+               lambda path: submit_transcription_job(path, cancel_when_orphaned=False),
+               needed=lambda path: not has_transcript(path)),
+    IndexStage("analysis",
+               lambda path: submit_analysis_job(path, cancel_when_orphaned=False)),
+])
+
+class IndexRequest(BaseModel):
+    folder: Optional[str] = None
+    paths: List[str] = []
+    recursive: bool = True
+
+@app.post("/index_library")
+def api_index_library(req: IndexRequest):
+    """Queue transcription and scene/object/emotion analysis for a folder or list of videos.
+
+    Files run one at a time in the background: the currently opened video
+    first, recently modified files next, the rest while nothing interactive
+    is running. Poll /index_status for per-file progress.
+    """
+    paths = list(req.paths)
+    if req.folder:
+        if not os.path.isdir(req.folder):
+            return {"error": "Folder not found"}
+        paths += find_videos(req.folder, req.recursive)
+    return {"status": "ok", "queued": library_indexer.enqueue(paths), "total": len(paths)}
+
+@app.get("/index_status")
+def api_index_status():
+    return library_indexer.status()
+
+@app.post("/index_current")
+def api_index_current(video_path: str):
+    """Tell the scheduler which video is open so it is indexed before anything else"""
+    library_indexer.set_current(video_path)
+    # Its frames also jump the inference batch queue
+    set_current_video(video_path)
+    return {"status": "ok"}
+
+# ---------- METRICS ----------
+
+from fastapi.responses import PlainTextResponse
+from jobs import QUEUED, RUNNING
+from metrics import Gauge, render as render_metrics
+
+def _jobs_in(status):
+    return {(kind,): count for (job_status, kind), count in job_manager.status_counts().items()
+            if job_status == status}
+
+Gauge("neuralplay_job_queue_depth", "Jobs waiting for a worker thread", lambda: _jobs_in(QUEUED), ["kind"])
+Gauge("neuralplay_active_jobs", "Jobs currently running", lambda: _jobs_in(RUNNING), ["kind"])
+Gauge("neuralplay_index_queue_depth", "Library files waiting to be indexed", library_indexer.queue_depth)
+Gauge("neuralplay_frame_ring_slots_used", "Shared-memory frame slots waiting on inference workers", ring_slots_in_use)
+
+@app.get("/metrics")
+def api_metrics():
+    """Prometheus text exposition of hot-path timings, queue depth and active jobs"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 # Summarization
-from summarization import summarize_scene
+from summarization import summarize_scene, summarize_scenes, SummaryCache
 @app.post("/summarize_scene")
 def api_summarize_scene(text: str):
     return {"summary": summarize_scene(text)}
 
 # Q&A System
-from qa_system import ask_question
-@app.post("/ask_question")
-def api_ask_question(query: str, video_path: str):
+from qa_system import ask_question, IndexCache, DEFAULT_TOP_K
+from database import transcript_listeners
+
+def load_transcript_segments(video_path):
     session = SessionLocal()
-    video = session.query(Video).filter(Video.path == video_path).first()
-    transcript_data = None
-    if video:
-        db_segments = session.query(Transcript).filter(Transcript.video_id == video.id).all()
-        if db_segments:
-            segments = [{"start": s.start_time, "end": s.end_time, "text": s.text} for s in db_segments]
-            full_text = " ".join([s.text for s in db_segments])
-            transcript_data = {"text": full_text, "segments": segments}
-    session.close()
-    return {"answer": ask_question(query, transcript_data)}
+    try:
+        rows = (session.query(Transcript.start_time, Transcript.end_time, Transcript.text)
+                .join(Video).filter(Video.path == video_path)
+                .order_by(Transcript.start_time).all())
+        return [{"start": start, "end": end, "text": text} for start, end, text in rows]
+    finally:
+        session.close()
+
+# Per-video BM25 indexes, rebuilt only after the transcript changes
+qa_indexes = IndexCache(load_transcript_segments)
+transcript_listeners.append(qa_indexes.invalidate)
+
+@app.post("/ask_question")
+def api_ask_question(query: str, video_path: str, k: int = DEFAULT_TOP_K):
+    answer, results = ask_question(query, qa_indexes.get(video_path), max(1, min(k, 20)))
+    return {"answer": answer, "results": results}
+
+# Chapters: one summary per detected scene
+from analysis_cache import load_latest_events
+
+scene_summaries = SummaryCache()
+transcript_listeners.append(scene_summaries.invalidate)
+
+class SceneBounds(BaseModel):
+    id: Optional[int] = None
+    start: float
+    end: float
+
+class ChaptersRequest(BaseModel):
+    scenes: List[SceneBounds] = []
+
+@app.post("/summarize_scenes")
+def api_summarize_scenes(video_path: str, req: Optional[ChaptersRequest] = None):
+    """Summarize the transcript of every scene of a video in one request.
+
+    Uses the scenes in the body, or the last scene detection stored for the
+    video. Transcript segments come from the cached Q&A index, so repeated
+    calls do not touch the database.
+    """
+    if req is not None and req.scenes:
+        scenes = [{"id": scene.id, "start": scene.start, "end": scene.end} for scene in req.scenes]
+    else:
+        scenes = [{"id": event["id"], "start": event["start"], "end": event["end"]}
+                  for event in load_latest_events(video_path, "scenes") or []]
+    if not scenes:
+        return {"error": "No scenes found. Analyze the video first."}
+    scenes.sort(key=lambda scene: scene["start"])
+
+    index = qa_indexes.get(video_path)
+    if index is None:
+        return {"error": "No transcript available. Please transcribe the video first."}
+
+    key, chapters = scene_summaries.get(video_path, scenes)
+    if chapters is None:
+        chapters = summarize_scenes(scenes, index.segments)
+        scene_summaries.put(key, chapters)
+    return {"chapters": chapters}
 
 # Video Trimming
+import time
+
+from clip_export import TRIM_MODES, clip_output_path, export_clips, trim_clip
+
 class TrimRequest(BaseModel):
     video_path: str
     start: float
     end: float
-
-import subprocess
-import time
+    mode: str = "smart"
 
 @app.post("/trim_video")
 def trim_video(req: TrimRequest):
+    """Cut a clip next to the source video.
+
+    mode="smart" (default) is frame accurate and re-encodes only the partial
+    GOPs at the edges; "fast" stream copies from the nearest keyframe;
+    "accurate" re-encodes the whole clip. Smart trims of videos it cannot
+    index or re-encode fall back to "fast", as the returned method says.
+    """
     if not os.path.exists(req.video_path):
         return {"error": "Video file not found"}
-        
-    # Generate output path
-    dir_name = os.path.dirname(req.video_path)
-    base_name = os.path.splitext(os.path.basename(req.video_path))[0]
-    timestamp = int(time.time())
-    output_path = os.path.join(dir_name, f"{base_name}_clip_{timestamp}.mp4")
-    
-    # FFmpeg command: fast stream copy
-    # -ss before -i for faster seeking
-    cmd = [
-        'ffmpeg', '-y',
-        '-ss', str(req.start),
-        '-to', str(req.end),
-        '-i', req.video_path,
-        '-c', 'copy',
-        output_path
-    ]
-    
-    # Hide console window on Windows
-    startupinfo = None
-    if os.name == 'nt':
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    if req.mode not in TRIM_MODES:
+        return {"error": f"Unknown trim mode: {req.mode}"}
+    return trim_clip(req.video_path, req.start, req.end, clip_output_path(req.video_path), req.mode)
 
-    try:
-        subprocess.run(cmd, check=True, capture_output=True, startupinfo=startupinfo)
-        return {"status": "success", "output_path": output_path, "message": f"Clip saved to {output_path}"}
-    except subprocess.CalledProcessError as e:
-        return {"error": f"FFmpeg failed: {e.stderr.decode() if e.stderr else str(e)}"}
-    except Exception as e:
-        return {"error": f"Trimming failed: {str(e)}"}
+class ClipRange(BaseModel):
+    start: float
+    end: float
+
+class ExportRequest(BaseModel):
+    video_path: str
+    clips: List[ClipRange]
+    mode: str = "smart"
+
+@app.post("/export_clips")
+def api_export_clips(req: ExportRequest):
+    """Trim several clips of one video in parallel; each clip reports its own result"""
+    if not os.path.exists(req.video_path):
+        return {"error": "Video file not found"}
+    if req.mode not in TRIM_MODES:
+        return {"error": f"Unknown trim mode: {req.mode}"}
+    started = time.perf_counter()
+    clips = export_clips(req.video_path, [(clip.start, clip.end) for clip in req.clips], req.mode)
+    return {"clips": clips, "seconds": round(time.perf_counter() - started, 2)}
 
 if __name__ == "__main__":
+    # Needed for the transcription process pool in the PyInstaller build
+    import multiprocessing
+    multiprocessing.freeze_support()
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,168 @@
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds, from a single small frame up to a long whisper chunk
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FPS_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Whisper real-time factor: processing seconds per second of audio
+RTF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+# Frames per model call
+BATCH_BUCKETS = (1, 2, 4, 8, 12, 16, 24, 32, 64)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus text format.
+
+    observe() is a bisect plus a few additions under a lock, cheap enough
+    to call per frame.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self.series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose values are read from a callback when metrics are scraped.
+
+    The callback returns a number, or a dict of label tuple -> number.
+    """
+
+    def __init__(self, name, help, callback, labelnames=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"[Metrics] Could not read {self.name}: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- HOT-PATH METRICS ----------
+
+FRAME_DECODE_SECONDS = Histogram(
+    "neuralplay_frame_decode_seconds", "Time to decode and deliver one sampled frame", ["strategy"])
+PREPROCESS_SECONDS = Histogram(
+    "neuralplay_preprocess_seconds", "Time spent preparing a batch of inputs for a model", ["analyzer"])
+INFERENCE_SECONDS = Histogram(
+    "neuralplay_inference_seconds", "Latency of one model call (one batch or one audio chunk)", ["analyzer"])
+INFERENCE_ITEMS = Counter(
+    "neuralplay_inference_items_total", "Frames or audio chunks passed through a model", ["analyzer"])
+ANALYSIS_FPS = Histogram(
+    "neuralplay_analysis_fps", "Sampled frames processed per second of wall time, per analysis run",
+    ["analyzer"], FPS_BUCKETS)
+SERIALIZE_SECONDS = Histogram(
+    "neuralplay_serialize_seconds", "Time spent encoding events as JSON", ["stream"])
+DB_WRITE_SECONDS = Histogram(
+    "neuralplay_db_write_seconds", "Duration of one database write transaction", ["table"])
+WHISPER_RTF = Histogram(
+    "neuralplay_whisper_real_time_factor", "Whisper processing time divided by audio duration, per chunk",
+    buckets=RTF_BUCKETS)
+BATCH_FRAMES = Histogram(
+    "neuralplay_inference_batch_frames", "Frames in one scheduled micro-batch, across all analyses", ["model"],
+    BATCH_BUCKETS)
+BATCH_STREAMS = Histogram(
+    "neuralplay_inference_batch_streams", "Analyses whose frames share one micro-batch", ["model"], BATCH_BUCKETS)
+QUEUE_WAIT_SECONDS = Histogram(
+    "neuralplay_inference_queue_wait_seconds", "Time frames wait in the scheduler before their batch starts",
+    ["model"])
@@ -1,82 +1,214 @@
-import cv2
-import os
 import json
+import threading
+
+import numpy as np
+
+from analysis_cache import run_analysis
+from detection_store import DETECTION_FORMAT, save_detections, to_columns
+from frame_source import Analyzer, make_gate
+from inference_pool import InFlight, get_scheduler
+from metrics import INFERENCE_ITEMS, INFERENCE_SECONDS
+from object_tracking import IOU_THRESHOLD, MAX_MISSED_GAPS, IntervalTracker
 
 # Lazy loading - model loads on first use, not at import
 _model = None
+_model_lock = threading.Lock()
 
 def get_model():
     global _model
-    if _model is None:
-        try:
-            from ultralytics import YOLO
-            _model = YOLO('yolov8n.pt')
-            print("[ObjectDetection] YOLO model loaded successfully")
-        except ImportError:
-            print("[ObjectDetection] YOLO not installed")
-            return None
-        except Exception as e:
-            print(f"[ObjectDetection] Error loading YOLO: {e}")
-            return None
-    return _model
-
-def detect_objects_streaming(video_path, interval_seconds=2.0):
-    """Generator that yields objects as they are detected"""
-    model = get_model()
-    
-    if model is None:
-        yield json.dumps({"error": "YOLO not installed. Run: pip install ultralytics"})
-        return
-    
-    if not os.path.exists(video_path):
-        yield json.dumps({"error": "File not found"})
-        return
-
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        yield json.dumps({"error": "Could not open video"})
-        return
-
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30
-    frame_interval = int(fps * interval_seconds)
-    frame_count = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        if frame_count % frame_interval == 0:
-            current_time = frame_count / fps
-            results = model(frame, verbose=False)
-            
-            frame_objects = []
-            for result in results:
-                for box in result.boxes:
-                    cls_id = int(box.cls[0])
-                    label = model.names[cls_id]
-                    conf = float(box.conf[0])
-                    if conf > 0.5:
-                        frame_objects.append(label)
-            
-            unique_objects = list(set(frame_objects))
-            if unique_objects:
-                detection = {
-                    "type": "object",
-                    "time": current_time,
-                    "objects": unique_objects
-                }
-                yield json.dumps(detection)
-        
-        frame_count += 1
-        
-    cap.release()
-    yield json.dumps({"type": "done", "message": "Object detection complete"})
-
-def detect_objects(video_path, interval_seconds=2.0):
+    with _model_lock:
+        if _model is None:
+            try:
+                from ultralytics import YOLO
+                _model = YOLO('yolov8n.pt')
+                print("[ObjectDetection] YOLO model loaded successfully")
+            except ImportError:
+                print("[ObjectDetection] YOLO not installed")
+                return None
+            except Exception as e:
+                print(f"[ObjectDetection] Error loading YOLO: {e}")
+                return None
+        return _model
+
+# Frames per YOLO call; on CPU larger batches stop paying off around 8
+DEFAULT_BATCH_SIZE = 8
+CONFIDENCE_THRESHOLD = 0.5
+
+def predict_batch(model, frames):
+    """Run YOLO on a list of frames in one call.
+
+    Returns one (cls, conf, xyxy) tuple of NumPy arrays per frame.
+    """
+    with INFERENCE_SECONDS.time("objects"):
+        results = model(frames, verbose=False)
+    INFERENCE_ITEMS.inc("objects", amount=len(frames))
+    output = []
+    for result in results:
+        boxes = result.boxes
+        output.append((
+            boxes.cls.cpu().numpy().astype(np.int32),
+            boxes.conf.cpu().numpy().astype(np.float32),
+            boxes.xyxy.cpu().numpy().astype(np.float32),
+        ))
+    return output
+
+class ObjectAnalyzer(Analyzer):
+    """Runs YOLO on batches of sampled frames and emits the unique labels per frame.
+
+    Batches go through the shared objects scheduler, which may merge them
+    with other analyses' frames; decoding continues while they run. Every
+    box is kept and written to the detection store when the run completes.
+    """
+    name = "objects"
+
+    def __init__(self, interval_seconds=2.0, batch_size=DEFAULT_BATCH_SIZE, sampling="fixed",
+                 min_interval=None, max_interval=None):
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(1, int(batch_size))
+        self.gate = make_gate(sampling, interval_seconds, min_interval, max_interval)
+
+    def cache_params(self):
+        return {"interval_seconds": self.interval_seconds, "confidence": CONFIDENCE_THRESHOLD,
+                "sampling": self.sampling_params(), "store": DETECTION_FORMAT}
+
+    def start(self, fps, total_frames):
+        super().start(fps, total_frames)
+        self.scheduler = get_scheduler("objects")
+        if not self.scheduler.available():
+            return "YOLO not installed. Run: pip install ultralytics"
+        # A request is never split, so it must fit in one scheduled batch
+        self.submit_size = min(self.batch_size, self.scheduler.max_batch)
+        self.pending = []
+        self.in_flight = InFlight()
+        self.records = []
+        self.names = {}
+        self.frame_size = None
+        return None
+
+    def process(self, frame, frame_index):
+        if self.frame_size is None:
+            self.frame_size = (frame.shape[1], frame.shape[0])
+        self.pending.append((frame_index / self.fps, frame))
+        if len(self.pending) < self.submit_size:
+            return self._collect()
+        return self._flush()
+
+    def pending_time(self):
+        times = [self.pending[0][0]] if self.pending else []
+        if self.in_flight.earliest() is not None:
+            times.append(self.in_flight.earliest()[0])
+        return min(times) if times else None
+
+    def _flush(self):
+        times = [t for t, _ in self.pending]
+        frames = [frame for _, frame in self.pending]
+        self.pending = []
+        # Inference overlaps with decoding the next batch; results come back in order
+        self.in_flight.add(times, self.scheduler.submit(self, self.video_path, frames))
+        return self._collect()
+
+    def _collect(self, wait_all=False):
+        events = []
+        for times, future in self.in_flight.take(wait_all):
+            try:
+                predictions, names = future.result()
+            except Exception as e:
+                print(f"[ObjectDetection] Inference failed at {times[0]:.1f}s: {e}")
+                self.failed_batches += 1
+                continue
+            self.records.append(to_columns(times, predictions))
+            self.names = names
+            events.extend(self._events(times, predictions, names))
+        return events
+
+    def _events(self, times, predictions, names):
+        events = []
+        for current_time, (cls, conf, _) in zip(times, predictions):
+            class_ids = np.unique(cls[conf > CONFIDENCE_THRESHOLD])
+            if class_ids.size == 0:
+                continue
+            events.append((current_time, {
+                "type": "object",
+                "time": current_time,
+                "objects": [names[int(c)] for c in class_ids]
+            }))
+        return events
+
+    def finish(self, frame_count):
+        events = self._flush() if self.pending else []
+        events.extend(self._collect(wait_all=True))
+        # A partial set of boxes would be served as if it were complete
+        if self.records and not self.failed_batches:
+            save_detections(self.video_path, self.records, self.names, self.frame_size)
+        events.append((frame_count / self.fps, {"type": "done", "message": "Object detection complete"}))
+        return events
+
+class ObjectIntervalAnalyzer(ObjectAnalyzer):
+    """Links detections across samples with IoU tracking and emits one
+    object_interval event per appearance instead of a label list per sample.
+
+    An interval is emitted when its object has been missing for
+    MAX_MISSED_GAPS sampling intervals, or at the end of the video.
+    """
+    name = "object_intervals"
+
+    def cache_params(self):
+        return dict(super().cache_params(), iou_threshold=IOU_THRESHOLD, max_missed_gaps=MAX_MISSED_GAPS)
+
+    def start(self, fps, total_frames):
+        error = super().start(fps, total_frames)
+        # Adaptive sampling can skip a static picture for up to max_interval
+        gap = self.gate.max_interval if self.gate is not None else self.interval_seconds
+        self.tracker = IntervalTracker(gap * MAX_MISSED_GAPS)
+        return error
+
+    def _events(self, times, predictions, names):
+        events = []
+        for current_time, (cls, conf, xyxy) in zip(times, predictions):
+            keep = conf > CONFIDENCE_THRESHOLD
+            events.extend(self.tracker.update(current_time, cls[keep], conf[keep], xyxy[keep], names))
+        return events
+
+    def finish(self, frame_count):
+        events = super().finish(frame_count)
+        done = events.pop()
+        events.extend(self.tracker.close(frame_count / self.fps))
+        events.append(done)
+        return events
+
+def detect_objects_streaming(video_path, interval_seconds=2.0, batch_size=DEFAULT_BATCH_SIZE, use_cache=True,
+                             sampling="fixed", min_interval=None, max_interval=None):
+    """Generator that yields objects as they are detected.
+
+    sampling="adaptive" runs YOLO only when the picture changed, between
+    min_interval and max_interval seconds apart.
+    """
+    analyzer = ObjectAnalyzer(interval_seconds, batch_size, sampling, min_interval, max_interval)
+    yield from run_analysis(video_path, [analyzer], use_cache)
+
+def detect_objects(video_path, interval_seconds=2.0, batch_size=DEFAULT_BATCH_SIZE, sampling="fixed",
+                   min_interval=None, max_interval=None):
     detections = []
-    for data in detect_objects_streaming(video_path, interval_seconds):
+    for data in detect_objects_streaming(video_path, interval_seconds, batch_size, True,
+                                         sampling, min_interval, max_interval):
         parsed = json.loads(data)
         if parsed.get("type") == "object":
             detections.append({"time": parsed["time"], "objects": parsed["objects"]})
     return {"detections": detections}
+
+def detect_object_intervals_streaming(video_path, interval_seconds=2.0, batch_size=DEFAULT_BATCH_SIZE, use_cache=True,
+                                      sampling="fixed", min_interval=None, max_interval=None):
+    """Generator that yields an object_interval event each time a tracked object leaves the picture"""
+    analyzer = ObjectIntervalAnalyzer(interval_seconds, batch_size, sampling, min_interval, max_interval)
+    yield from run_analysis(video_path, [analyzer], use_cache)
+
+def detect_object_intervals(video_path, interval_seconds=2.0, batch_size=DEFAULT_BATCH_SIZE, sampling="fixed",
+                            min_interval=None, max_interval=None):
+    intervals = []
+    for data in detect_object_intervals_streaming(video_path, interval_seconds, batch_size, True,
+                                                  sampling, min_interval, max_interval):
+        parsed = json.loads(data)
+        if parsed.get("type") == "object_interval":
+            intervals.append({key: parsed[key] for key in ("track", "label", "start", "end", "samples", "confidence")})
+    intervals.sort(key=lambda interval: interval["start"])
+    return {"intervals": intervals}
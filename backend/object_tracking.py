@@ -0,0 +1,89 @@
+import numpy as np
+
+# Boxes of the same class overlapping at least this much in consecutive samples are one object
+IOU_THRESHOLD = 0.3
+# An object not seen for this many sampling intervals has left the picture; one missed sample is tolerated
+MAX_MISSED_GAPS = 2.5
+
+
+def iou_matrix(a, b):
+    """Pairwise intersection over union of two (N, 4) and (M, 4) xyxy box arrays"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class IntervalTracker:
+    """Links detections across samples and reports how long each object stayed visible.
+
+    Each sample's boxes are matched greedily, best IoU first, against the
+    open tracks of the same class; unmatched boxes start new tracks. A track
+    not matched for max_gap seconds is closed and returned as one interval.
+    """
+
+    def __init__(self, max_gap, iou_threshold=IOU_THRESHOLD):
+        self.max_gap = max_gap
+        self.iou_threshold = iou_threshold
+        self.tracks = []  # open tracks: dicts with id, cls, box, start, end, confidence, samples
+        self.next_id = 1
+
+    def update(self, current_time, cls, conf, xyxy, names):
+        """Feed one sample's boxes; returns (time, event) for every track that ended before it"""
+        closed = [track for track in self.tracks if current_time - track["end"] > self.max_gap]
+        self.tracks = [track for track in self.tracks if current_time - track["end"] <= self.max_gap]
+
+        for class_id in np.unique(cls):
+            indices = np.flatnonzero(cls == class_id)
+            candidates = [track for track in self.tracks if track["cls"] == class_id]
+            matched = set()
+            if candidates:
+                overlaps = iou_matrix([track["box"] for track in candidates], xyxy[indices])
+                extended = set()
+                for flat in np.argsort(overlaps, axis=None)[::-1]:
+                    t, d = divmod(int(flat), len(indices))
+                    if overlaps[t, d] < self.iou_threshold:
+                        break
+                    if t in extended or d in matched:
+                        continue
+                    extended.add(t)
+                    matched.add(d)
+                    track = candidates[t]
+                    track["box"] = xyxy[indices[d]]
+                    track["end"] = current_time
+                    track["confidence"] = max(track["confidence"], float(conf[indices[d]]))
+                    track["samples"] += 1
+            for d, index in enumerate(indices):
+                if d not in matched:
+                    self.tracks.append({
+                        "id": self.next_id,
+                        "cls": class_id,
+                        "label": names[int(class_id)],
+                        "box": xyxy[index],
+                        "start": current_time,
+                        "end": current_time,
+                        "confidence": float(conf[index]),
+                        "samples": 1,
+                    })
+                    self.next_id += 1
+        return [(current_time, self._interval(track)) for track in closed]
+
+    def close(self, current_time):
+        """End every open track, at the end of the video"""
+        closed, self.tracks = self.tracks, []
+        return [(current_time, self._interval(track)) for track in sorted(closed, key=lambda track: track["start"])]
+
+    def _interval(self, track):
+        return {
+            "type": "object_interval",
+            "track": track["id"],
+            "label": track["label"],
+            "start": round(float(track["start"]), 2),
+            "end": round(float(track["end"]), 2),
+            "samples": track["samples"],
+            "confidence": round(track["confidence"], 3)
+        }
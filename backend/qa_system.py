@@ -1,34 +1,143 @@
+from collections import OrderedDict
 from datetime import timedelta
+import heapq
+import math
+import re
+import threading
 
-def ask_question(query, transcript_data):
-    if not transcript_data:
-        return "No transcript available. Please transcribe the video first."
+# BM25 parameters; the usual defaults work well for short transcript segments
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Videos whose transcript index stays in memory
+INDEX_CACHE_SIZE = 8
+DEFAULT_TOP_K = 3
+# "When" answers only list segments scoring at least this share of the best one,
+# so a segment matching one common query word does not add a time
+WHEN_MIN_SCORE_RATIO = 0.5
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'at', 'be', 'did', 'do', 'does', 'for', 'from', 'happen', 'how',
+    'i', 'in', 'is', 'it', 'of', 'on', 'or', 'say', 'show', 'that', 'the', 'this', 'to',
+    'video', 'was', 'what', 'when', 'where', 'which', 'who', 'why', 'with'
+}
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return [word for word in _TOKEN.findall(text.lower()) if word not in STOP_WORDS]
+
+
+class TranscriptIndex:
+    """Inverted index over one video's transcript segments, ranked with BM25.
+
+    Built once per transcript; a query only touches the postings of its own
+    terms, so latency does not grow with the length of the transcript.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.text = " ".join(seg['text'] for seg in segments)
+        self.postings = {}
+        self.lengths = []
+        for i, seg in enumerate(segments):
+            counts = {}
+            for term in tokenize(seg['text']):
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((i, tf))
+            self.lengths.append(sum(counts.values()))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        count = len(segments)
+        self.idf = {term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for term, docs in self.postings.items()}
+
+    def search(self, query, k=DEFAULT_TOP_K):
+        """Top-k segments for the query as dicts with start, end, text and score"""
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / (self.avg_length or 1))
+                scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [dict(self.segments[i], score=round(score, 3)) for i, score in best]
+
+
+class IndexCache:
+    """LRU cache of TranscriptIndex objects keyed by video path.
+
+    load(video_path) returns the segment list or None; it is only called on
+    a miss. Writers call invalidate() when a transcript changes.
+    """
+
+    def __init__(self, load, capacity=INDEX_CACHE_SIZE):
+        self.load = load
+        self.capacity = capacity
+        self.indexes = OrderedDict()
+        # Bumped on invalidate so an index built from rows read before a write is not cached
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, video_path):
+        with self.lock:
+            index = self.indexes.get(video_path)
+            if index is not None:
+                self.indexes.move_to_end(video_path)
+                return index
+            generation = self.generations.get(video_path, 0)
+        segments = self.load(video_path)
+        if not segments:
+            return None
+        index = TranscriptIndex(segments)
+        with self.lock:
+            if self.generations.get(video_path, 0) != generation:
+                return index
+            self.indexes[video_path] = index
+            self.indexes.move_to_end(video_path)
+            while len(self.indexes) > self.capacity:
+                self.indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, video_path):
+        with self.lock:
+            self.indexes.pop(video_path, None)
+            self.generations[video_path] = self.generations.get(video_path, 0) + 1
+
+
+def _timestamp(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+
+def ask_question(query, index, k=DEFAULT_TOP_K):
+    """Answer a question from a TranscriptIndex.
+
+    Returns the answer text and the top-k ranked segments it is based on.
+    """
+    if index is None:
+        return "No transcript available. Please transcribe the video first.", []
+
+    lowered = query.lower()
 
-    query = query.lower()
-    text_content = transcript_data.get('text', '').lower()
-    segments = transcript_data.get('segments', [])
-    
     # Summary question
-    if 'about' in query or 'summar' in query:
-        return f"This video discusses: {text_content[:200]}..."
+    if 'about' in lowered or 'summar' in lowered:
+        return f"This video discusses: {index.text[:200]}...", []
+
+    results = index.search(query, k)
+    for result in results:
+        result['timestamp'] = _timestamp(result['start'])
+    if not results:
+        return "I couldn't find specific information about that in the video.", []
 
     # When question
-    if 'when' in query:
-        keywords = [w for w in query.split() if w not in ['when', 'does', 'happen', 'the', 'video', 'in', 'show', 'say', 'is', 'it']]
-        found = []
-        for kw in keywords:
-            for seg in segments:
-                if kw in seg['text'].lower():
-                    found.append(seg)
-        
-        if found:
-            times = sorted(list(set([s['start'] for s in found])))[:3]
-            time_strs = [str(timedelta(seconds=int(t))) for t in times]
-            return f"Found mentions around: {', '.join(time_strs)}."
-            
-    # General check
-    for seg in segments:
-        if any(word in seg['text'].lower() for word in query.split() if len(word) > 3):
-            return f"Found at {int(seg['start'])}s: \"{seg['text']}\""
-
-    return "I couldn't find specific information about that in the video."
+    if 'when' in lowered:
+        cutoff = results[0]['score'] * WHEN_MIN_SCORE_RATIO
+        results = [result for result in results if result['score'] >= cutoff]
+        # Segments starting within the same second share a timestamp
+        times = dict.fromkeys(_timestamp(t) for t in sorted(result['start'] for result in results))
+        return f"Found mentions around: {', '.join(times)}.", results
+
+    best = results[0]
+    return f"Found at {int(best['start'])}s: \"{best['text']}\"", results
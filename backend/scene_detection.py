@@ -1,15 +1,17 @@
 import cv2
-import os
+import importlib.util
 import json
 import numpy as np
+import threading
 
-# Try to use better scene detection if available
-try:
-    import torch
-    from torchvision import models, transforms
-    DEEP_LEARNING_AVAILABLE = True
-except ImportError:
-    DEEP_LEARNING_AVAILABLE = False
+from analysis_cache import run_analysis
+from frame_source import Analyzer
+from inference_pool import InFlight, get_scheduler
+from metrics import INFERENCE_ITEMS, INFERENCE_SECONDS, PREPROCESS_SECONDS
+
+# Try to use better scene detection if available. Only check that torch is
+# installed here; importing it takes seconds and would delay backend startup.
+DEEP_LEARNING_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("torch", "torchvision"))
 
 # Pre-defined scene categories for classification
 SCENE_CATEGORIES = [
@@ -17,144 +19,205 @@ SCENE_CATEGORIES = [
     "dialogue", "transition", "establishing_shot", "close_up", "wide_shot"
 ]
 
+# ImageNet normalization used by the ResNet weights
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+INPUT_SIZE = 224
+
+# Frames per ResNet forward pass
+DEFAULT_BATCH_SIZE = 16
+
+# Lazy loading - ResNet is built once per process on first use
+_feature_extractor = None
+# Held while loading so warm-up and a request never build the model twice
+_feature_extractor_lock = threading.Lock()
+
 def get_feature_extractor():
     """Load a pre-trained ResNet for feature extraction"""
+    global _feature_extractor
     if not DEEP_LEARNING_AVAILABLE:
-        return None, None
-    
-    model = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
-    model = torch.nn.Sequential(*list(model.children())[:-1])  # Remove classifier
-    model.eval()
-    
-    transform = transforms.Compose([
-        transforms.ToPILImage(),
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    
-    return model, transform
-
-def detect_scenes_streaming(video_path, threshold=0.7):
-    """Generator that yields scenes as they are detected using AI features"""
-    if not os.path.exists(video_path):
-        yield json.dumps({"error": "File not found"})
-        return
-    
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        yield json.dumps({"error": "Could not open video"})
-        return
-        
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    # Try to use deep learning, fallback to histogram
-    model, transform = None, None
-    if DEEP_LEARNING_AVAILABLE:
-        try:
-            model, transform = get_feature_extractor()
-        except:
-            pass
-    
-    prev_features = None
-    start_frame = 0
-    frame_count = 0
+        return None
+    with _feature_extractor_lock:
+        if _feature_extractor is None:
+            import torch
+            from torchvision import models
+            model = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
+            model = torch.nn.Sequential(*list(model.children())[:-1])  # Remove classifier
+            model.eval()
+            _feature_extractor = model
+            print("[SceneDetection] ResNet18 feature extractor loaded")
+        return _feature_extractor
+
+def preprocess_frames(frames):
+    """Resize and normalize BGR frames into an NCHW float tensor with cv2/NumPy"""
+    import torch
+    batch = np.empty((len(frames), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+    for i, frame in enumerate(frames):
+        resized = cv2.resize(frame, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_AREA)
+        batch[i] = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    batch /= 255.0
+    batch -= IMAGENET_MEAN
+    batch /= IMAGENET_STD
+    return torch.from_numpy(batch.transpose(0, 3, 1, 2).copy())
+
+def embed_frames(model, frames):
+    """Return L2-normalized ResNet embeddings, one row per frame"""
+    import torch
+    with PREPROCESS_SECONDS.time("scenes"):
+        batch = preprocess_frames(frames)
+    with INFERENCE_SECONDS.time("scenes"), torch.no_grad():
+        features = model(batch).flatten(1).numpy()
+    INFERENCE_ITEMS.inc("scenes", amount=len(frames))
+    return features / (np.linalg.norm(features, axis=1, keepdims=True) + 1e-8)
+
+class SceneAnalyzer(Analyzer):
+    """Detects scene cuts from ResNet features, falling back to HSV histograms"""
+    name = "scenes"
     skip_frames = 15  # Check every 15 frames for efficiency
-    scene_count = 0
-    
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        if frame_count % skip_frames == 0:
-            # Deep learning feature extraction
-            if model is not None and transform is not None:
-                try:
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    input_tensor = transform(rgb_frame).unsqueeze(0)
-                    with torch.no_grad():
-                        features = model(input_tensor).squeeze().numpy()
-                    
-                    if prev_features is not None:
-                        # Cosine similarity between feature vectors
-                        similarity = np.dot(features, prev_features) / (
-                            np.linalg.norm(features) * np.linalg.norm(prev_features) + 1e-8
-                        )
-                        
-                        if similarity < threshold:
-                            end_frame = frame_count
-                            duration = (end_frame - start_frame) / fps
-                            if duration > 1.0:  # Minimum 1 second scenes
-                                scene_count += 1
-                                scene = {
-                                    "type": "scene",
-                                    "id": scene_count,
-                                    "start": round(start_frame / fps, 2),
-                                    "end": round(end_frame / fps, 2),
-                                    "duration": round(duration, 2),
-                                    "confidence": round(1 - similarity, 2)
-                                }
-                                yield json.dumps(scene)
-                            start_frame = frame_count
-                    
-                    prev_features = features
-                except Exception as e:
-                    # Fallback to histogram on error
-                    pass
-            else:
-                # Fallback: Simple histogram comparison
-                hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-                hist = cv2.calcHist([hsv], [0, 1], None, [50, 60], [0, 180, 0, 256])
-                cv2.normalize(hist, hist, 0, 1, cv2.NORM_MINMAX)
-                features = hist.flatten()
-                
-                if prev_features is not None:
-                    score = cv2.compareHist(
-                        prev_features.reshape(50, 60), 
-                        features.reshape(50, 60), 
-                        cv2.HISTCMP_CORREL
-                    )
-                    
-                    if score < 0.85:
-                        end_frame = frame_count
-                        duration = (end_frame - start_frame) / fps
-                        if duration > 1.0:
-                            scene_count += 1
-                            scene = {
-                                "type": "scene",
-                                "id": scene_count,
-                                "start": round(start_frame / fps, 2),
-                                "end": round(end_frame / fps, 2),
-                                "duration": round(duration, 2)
-                            }
-                            yield json.dumps(scene)
-                        start_frame = frame_count
-                
-                prev_features = features
-            
-        frame_count += 1
-        
-    # Last scene
-    duration = (frame_count - start_frame) / fps
-    if duration > 1.0:
-        scene_count += 1
-        scene = {
-            "type": "scene",
-            "id": scene_count,
-            "start": round(start_frame / fps, 2),
-            "end": round(frame_count / fps, 2),
-            "duration": round(duration, 2)
+
+    def __init__(self, threshold=0.7, batch_size=DEFAULT_BATCH_SIZE):
+        self.threshold = threshold
+        self.batch_size = max(1, int(batch_size))
+        self.deep = None
+
+    def frame_interval(self, fps):
+        return self.skip_frames
+
+    def use_deep_learning(self):
+        """Whether ResNet features are used, settled on the first call.
+
+        The cache lookup asks before start() and the stored run after it,
+        so both must see the same answer.
+        """
+        if self.deep is None:
+            self.deep = bool(DEEP_LEARNING_AVAILABLE and get_scheduler("scenes").available())
+        return self.deep
+
+    def cache_params(self):
+        return {
+            "threshold": self.threshold,
+            "skip_frames": self.skip_frames,
+            "method": "deep_learning" if self.use_deep_learning() else "histogram"
         }
-        yield json.dumps(scene)
-        
-    cap.release()
-    yield json.dumps({
-        "type": "done", 
-        "message": f"Scene detection complete. Found {scene_count} scenes.",
-        "method": "deep_learning" if DEEP_LEARNING_AVAILABLE else "histogram"
-    })
+
+    def start(self, fps, total_frames):
+        super().start(fps, total_frames)
+        # Try to use deep learning, fallback to histogram
+        self.scheduler = get_scheduler("scenes") if self.use_deep_learning() else None
+        if self.deep:
+            self.submit_size = min(self.batch_size, self.scheduler.max_batch)
+        self.in_flight = InFlight()
+        self.prev_features = None
+        self.pending = []
+        self.start_frame = 0
+        self.scene_count = 0
+        return None
+
+    def _scene(self, end_frame, confidence=None):
+        """Close the current scene at end_frame, returning its event if long enough"""
+        duration = (end_frame - self.start_frame) / self.fps
+        events = []
+        if duration > 1.0:  # Minimum 1 second scenes
+            self.scene_count += 1
+            scene = {
+                "type": "scene",
+                "id": self.scene_count,
+                "start": round(self.start_frame / self.fps, 2),
+                "end": round(end_frame / self.fps, 2),
+                "duration": round(duration, 2)
+            }
+            if confidence is not None:
+                scene["confidence"] = confidence
+            events.append((end_frame / self.fps, scene))
+        self.start_frame = end_frame
+        return events
+
+    def process(self, frame, frame_index):
+        # Deep learning feature extraction, batched
+        if self.deep:
+            self.pending.append((frame_index, frame))
+            if len(self.pending) < self.submit_size:
+                return self._collect()
+            return self._flush()
+
+        # Fallback: Simple histogram comparison
+        events = []
+        with INFERENCE_SECONDS.time("scenes"):
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            hist = cv2.calcHist([hsv], [0, 1], None, [50, 60], [0, 180, 0, 256])
+            cv2.normalize(hist, hist, 0, 1, cv2.NORM_MINMAX)
+            features = hist.flatten()
+        INFERENCE_ITEMS.inc("scenes")
+
+        if self.prev_features is not None:
+            score = cv2.compareHist(
+                self.prev_features.reshape(50, 60),
+                features.reshape(50, 60),
+                cv2.HISTCMP_CORREL
+            )
+
+            if score < 0.85:
+                events = self._scene(frame_index)
+
+        self.prev_features = features
+        return events
+
+    def pending_time(self):
+        indices = [self.pending[0][0]] if self.pending else []
+        if self.in_flight.earliest() is not None:
+            indices.append(self.in_flight.earliest()[0])
+        return min(indices) / self.fps if indices else None
+
+    def _flush(self):
+        indices = [i for i, _ in self.pending]
+        frames = [f for _, f in self.pending]
+        self.pending = []
+        # Batches come back in submission order, so the similarity chain stays intact
+        self.in_flight.add(indices, self.scheduler.submit(self, self.video_path, frames))
+        return self._collect()
+
+    def _collect(self, wait_all=False):
+        events = []
+        for indices, future in self.in_flight.take(wait_all):
+            try:
+                features = future.result()
+            except Exception as e:
+                print(f"[SceneDetection] Skipping batch of {len(indices)} frames: {e}")
+                self.failed_batches += 1
+                continue
+            events.extend(self._cuts(indices, features))
+        return events
+
+    def _cuts(self, indices, features):
+        # Cosine similarity of every frame against the one before it, in one pass
+        if self.prev_features is None:
+            previous = np.vstack([features[:1], features[:-1]])
+        else:
+            previous = np.vstack([self.prev_features[None, :], features[:-1]])
+        similarities = np.einsum('ij,ij->i', features, previous)
+        self.prev_features = features[-1]
+
+        events = []
+        for frame_index, similarity in zip(indices, similarities):
+            if similarity < self.threshold:
+                events.extend(self._scene(frame_index, round(float(1 - similarity), 2)))
+        return events
+
+    def finish(self, frame_count):
+        events = self._flush() if self.pending else []
+        events.extend(self._collect(wait_all=True))
+        # Last scene
+        events.extend(self._scene(frame_count))
+        events.append((frame_count / self.fps, {
+            "type": "done",
+            "message": f"Scene detection complete. Found {self.scene_count} scenes.",
+            "method": "deep_learning" if self.deep else "histogram"
+        }))
+        return events
+
+def detect_scenes_streaming(video_path, threshold=0.7, batch_size=DEFAULT_BATCH_SIZE, use_cache=True):
+    """Generator that yields scenes as they are detected using AI features"""
+    yield from run_analysis(video_path, [SceneAnalyzer(threshold, batch_size)], use_cache)
 
 # Keep old function for backwards compatibility
 def detect_scenes(video_path, threshold=30.0):
@@ -1,18 +1,94 @@
-from collections import Counter
+from bisect import bisect_right
+from collections import Counter, OrderedDict
 import re
+import threading
+
+STOP_WORDS = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'is', 'was', 'it', 'this', 'that', 'i', 'you', 'we', 'they', 'he', 'she'}
+
+# Scene summaries kept per (video, scene list)
+SUMMARY_CACHE_SIZE = 32
+
+def keywords_of(text):
+    """Lowercased words worth counting: no stop words, longer than two characters"""
+    return [w for w in re.findall(r'\w+', text.lower()) if w not in STOP_WORDS and len(w) > 2]
+
+def summarize_keywords(counts, max_keywords=5):
+    keywords = [w for w, c in counts.most_common(max_keywords)]
+    return "Key topics: " + ", ".join(keywords) if keywords else "No key topics found."
 
 def summarize_text(text, max_words=20):
     if not text:
         return ""
-    
-    words = re.findall(r'\w+', text.lower())
-    common = Counter(words).most_common(10)
-    
-    stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'is', 'was', 'it', 'this', 'that', 'i', 'you', 'we', 'they', 'he', 'she'}
-    keywords = [w for w, c in common if w not in stop_words and len(w) > 2]
-    
-    summary = "Key topics: " + ", ".join(keywords[:5]) if keywords else "No key topics found."
-    return summary
+    return summarize_keywords(Counter(keywords_of(text)))
 
 def summarize_scene(scene_text):
     return summarize_text(scene_text)
+
+def align_segments(scenes, segments):
+    """Group transcript segments by the scene their midpoint falls in.
+
+    scenes are dicts with start/end sorted by start; a binary search over
+    the scene starts places each segment, so aligning is O(n log m).
+    Returns one list of segment indices per scene.
+    """
+    starts = [scene['start'] for scene in scenes]
+    groups = [[] for _ in scenes]
+    for i, seg in enumerate(segments):
+        middle = (seg['start'] + seg['end']) / 2
+        index = bisect_right(starts, middle) - 1
+        if index >= 0 and middle < scenes[index]['end']:
+            groups[index].append(i)
+    return groups
+
+def summarize_scenes(scenes, segments):
+    """Summarize every scene from the transcript in one pass.
+
+    Each segment is tokenized and stop-word filtered once; a scene's
+    keywords are the sum of its segments' counts.
+    """
+    tokens = [Counter(keywords_of(seg['text'])) for seg in segments]
+    chapters = []
+    for scene, group in zip(scenes, align_segments(scenes, segments)):
+        counts = Counter()
+        for i in group:
+            counts.update(tokens[i])
+        chapters.append({
+            "id": scene.get('id'),
+            "start": scene['start'],
+            "end": scene['end'],
+            "segments": len(group),
+            "summary": summarize_keywords(counts) if group else ""
+        })
+    return chapters
+
+class SummaryCache:
+    """LRU cache of scene summaries keyed by video path and scene boundaries"""
+
+    def __init__(self, capacity=SUMMARY_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        # Part of the key, so summaries computed from a transcript that changed meanwhile are never hit
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, video_path, scenes):
+        """Return (key, chapters or None); pass the key to put() after a miss"""
+        bounds = tuple((scene['start'], scene['end']) for scene in scenes)
+        with self.lock:
+            key = (video_path, self.generations.get(video_path, 0), bounds)
+            chapters = self.entries.get(key)
+            if chapters is not None:
+                self.entries.move_to_end(key)
+            return key, chapters
+
+    def put(self, key, chapters):
+        with self.lock:
+            self.entries[key] = chapters
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, video_path):
+        with self.lock:
+            self.generations[video_path] = self.generations.get(video_path, 0) + 1
+            for key in [key for key in self.entries if key[0] == video_path]:
+                del self.entries[key]
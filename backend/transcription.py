@@ -1,5 +1,15 @@
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+import importlib.util
 import os
 import subprocess
+import threading
+import time
+
+import numpy as np
+
+from inference_pool import INFERENCE_WORKERS
+from metrics import INFERENCE_ITEMS, INFERENCE_SECONDS, WHISPER_RTF
 
 # Try to find ffmpeg and add to PATH
 def setup_ffmpeg():
@@ -31,83 +41,319 @@ def setup_ffmpeg():
     return False
 
 # Lazy loading for Whisper
+WHISPER_MODEL_NAME = "tiny"
 _model = None
+_model_lock = threading.Lock()
 
 def get_whisper_model():
     global _model
-    if _model is None:
-        # Setup ffmpeg first
-        if not setup_ffmpeg():
-            print("[Transcription] Warning: FFmpeg not found. Transcription may fail.")
+    with _model_lock:
+        if _model is None:
+            # Setup ffmpeg first
+            if not setup_ffmpeg():
+                print("[Transcription] Warning: FFmpeg not found. Transcription may fail.")
         
+            try:
+                import whisper
+                _model = whisper.load_model(WHISPER_MODEL_NAME)  # Use tiny for speed (4x faster than base)
+                print("[Transcription] Whisper 'tiny' model loaded (optimized for speed)")
+            except ImportError:
+                print("[Transcription] Whisper not installed")
+                return None
+            except Exception as e:
+                print(f"[Transcription] Error loading Whisper: {e}")
+                return None
+        return _model
+
+# Whisper expects 16 kHz mono float32 audio
+SAMPLE_RATE = 16000
+
+def _startupinfo():
+    # specific for windows to hide console window
+    startupinfo = None
+    if os.name == 'nt':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+def _audio_command(video_path, start=0.0, duration=None):
+    # -vn: no video, s16le on stdout: raw 16-bit PCM, -ar 16000 -ac 1: what whisper expects
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error']
+    if start:
+        cmd += ['-ss', str(start)]
+    if duration is not None:
+        cmd += ['-t', str(duration)]
+    cmd += [
+        '-i', video_path,
+        '-vn',
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ar', str(SAMPLE_RATE),
+        '-ac', '1',
+        '-'
+    ]
+    return cmd
+
+def _pcm_to_float(raw):
+    return np.frombuffer(raw, np.int16).astype(np.float32) / 32768.0
+
+def load_audio(video_path):
+    """Decode the whole soundtrack to a float32 array in memory"""
+    result = subprocess.run(_audio_command(video_path), check=True, capture_output=True, startupinfo=_startupinfo())
+    return _pcm_to_float(result.stdout)
+
+def _drain_stderr(stream, tail):
+    # Keeps reading so a chatty ffmpeg never blocks on a full stderr pipe
+    for line in stream:
+        tail.append(line)
+
+def iter_audio_chunks(video_path, chunk_duration=20, start=0.0, duration=None):
+    """Yield (offset_seconds, float32 array) chunks decoded by one long-lived ffmpeg process.
+
+    The container is opened and demuxed once; chunks are read off ffmpeg's
+    stdout so no temp files or per-chunk processes are needed. stderr is
+    drained on a thread, keeping the last lines for the error message.
+    """
+    proc = subprocess.Popen(_audio_command(video_path, start, duration), stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, startupinfo=_startupinfo())
+    stderr_tail = deque(maxlen=20)
+    drain = threading.Thread(target=_drain_stderr, args=(proc.stderr, stderr_tail), daemon=True)
+    drain.start()
+    chunk_bytes = int(chunk_duration * SAMPLE_RATE) * 2
+    offset = start
+    produced = False
+    try:
+        while True:
+            raw = proc.stdout.read(chunk_bytes)
+            if not raw:
+                break
+            audio = _pcm_to_float(raw[:len(raw) - len(raw) % 2])
+            produced = True
+            yield offset, audio
+            offset += len(audio) / SAMPLE_RATE
+        proc.wait()
+        drain.join()
+        if not produced and proc.returncode:
+            message = b"".join(stderr_tail).decode(errors='replace').strip()
+            raise RuntimeError(message or "no audio decoded")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        drain.join()
+        proc.stdout.close()
+        proc.stderr.close()
+
+def iter_scheduled_chunks(video_path, chunk_duration=20, playback_position=0.0):
+    """Yield the audio chunk under the playhead first, then every other chunk in timestamp order"""
+    start = int(max(0.0, playback_position) // chunk_duration) * chunk_duration
+    if start == 0:
+        yield from iter_audio_chunks(video_path, chunk_duration)
+        return
+    yield from iter_audio_chunks(video_path, chunk_duration, start, duration=chunk_duration)
+    yield from iter_audio_chunks(video_path, chunk_duration, 0.0, duration=start)
+    yield from iter_audio_chunks(video_path, chunk_duration, start + chunk_duration)
+
+# ---------- PARALLEL TRANSCRIPTION ----------
+
+# Rough resident size of one worker process holding the whisper model
+WORKER_MEMORY_MB = 500
+DEFAULT_WORKERS = 1
+
+_pool = None
+_pool_workers = 0
+# Jobs currently submitting to each pool
+_pool_users = {}
+_pool_lock = threading.Lock()
+
+def _init_pool_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+    get_whisper_model()
+
+def _whisper_ready():
+    return get_whisper_model() is not None
+
+def _transcribe_audio(audio):
+    """Runs inside a pool worker: a whole soundtrack, returned as (text, segments)"""
+    model = get_whisper_model()
+    if model is None:
+        raise RuntimeError("Whisper not available in worker")
+    result = model.transcribe(audio)
+    return result.get("text", ""), _offset_segments(result, 0.0)
+
+def _transcribe_chunk(offset, audio):
+    """Runs inside a pool worker, each of which holds its own whisper model.
+
+    Returns the segments and the inference time, which the parent records
+    because metrics live in the server process.
+    """
+    model = get_whisper_model()
+    if model is None:
+        raise RuntimeError("Whisper not available in worker")
+    started = time.perf_counter()
+    result = model.transcribe(audio)
+    return _offset_segments(result, offset), time.perf_counter() - started
+
+def _record_chunk_metrics(duration, elapsed):
+    INFERENCE_SECONDS.observe(elapsed, "transcription")
+    INFERENCE_ITEMS.inc("transcription")
+    if duration > 0:
+        WHISPER_RTF.observe(elapsed / duration)
+
+def _offset_segments(result, offset):
+    return [{
+        "start": seg["start"] + offset,
+        "end": seg["end"] + offset,
+        "text": seg["text"].strip()
+    } for seg in result.get("segments", [])]
+
+def resolve_worker_count(workers, max_memory_mb=None):
+    """Clamp the requested worker count to the CPU count and the memory ceiling"""
+    workers = max(1, min(int(workers), os.cpu_count() or 1))
+    if max_memory_mb:
+        workers = max(1, min(workers, int(max_memory_mb) // WORKER_MEMORY_MB))
+    return workers
+
+def whisper_available():
+    """Whether transcription can run; only checks that whisper is importable when it runs in workers"""
+    if INFERENCE_WORKERS <= 0:
+        return get_whisper_model() is not None
+    return importlib.util.find_spec("whisper") is not None
+
+def acquire_transcription_pool(workers):
+    """Process pool of whisper workers, kept alive between requests so models load once.
+
+    Returns (pool, worker count). A pool of a different size is only replaced
+    while no job is using it; otherwise the caller shares the existing one.
+    Every call must be paired with release_transcription_pool(pool).
+    With NEURALPLAY_INFERENCE_WORKERS=0 the "pool" is a single thread using
+    this process's model, which still keeps whisper calls from overlapping.
+    """
+    global _pool, _pool_workers
+    if INFERENCE_WORKERS <= 0:
+        workers = 1
+    with _pool_lock:
+        if _pool is not None and _pool_workers != workers and not _pool_users.get(_pool):
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None and INFERENCE_WORKERS <= 0:
+            from concurrent.futures import ThreadPoolExecutor
+            _pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+            _pool_workers = 1
+        if _pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_pool_worker, initargs=(threads,))
+            _pool_workers = workers
+            print(f"[Transcription] Started {workers} whisper worker processes")
+        _pool_users[_pool] = _pool_users.get(_pool, 0) + 1
+        return _pool, _pool_workers
+
+def release_transcription_pool(pool):
+    with _pool_lock:
+        _pool_users[pool] -= 1
+        if not _pool_users[pool]:
+            del _pool_users[pool]
+
+def _discard_broken_pool(pool):
+    """A worker died, which breaks the whole pool; the next job starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            print("[Transcription] A whisper worker died, restarting the workers")
+            pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def warm_up_transcription_pool(workers=DEFAULT_WORKERS):
+    """Start the whisper workers and load their models; None if whisper is not usable"""
+    if not whisper_available():
+        return None
+    pool, _ = acquire_transcription_pool(workers)
+    try:
+        return pool.submit(_whisper_ready).result() or None
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        raise
+    finally:
+        release_transcription_pool(pool)
+
+def shutdown_transcription_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+class ChunkTranscriptionError(Exception):
+    pass
+
+def _transcribe_parallel(pool, chunks, in_flight):
+    """Transcribe chunks on the pool, yielding results in submission order"""
+    pending = deque()
+
+    def collect():
+        offset, span, duration, future = pending.popleft()
+        if future is None:
+            return offset, span, []
         try:
-            import whisper
-            _model = whisper.load_model("tiny")  # Use tiny for speed (4x faster than base)
-            print("[Transcription] Whisper 'tiny' model loaded (optimized for speed)")
-        except ImportError:
-            print("[Transcription] Whisper not installed")
-            return None
+            segments, elapsed = future.result()
+        except BrokenProcessPool:
+            raise
         except Exception as e:
-            print(f"[Transcription] Error loading Whisper: {e}")
-            return None
-    return _model
+            raise ChunkTranscriptionError(f"Transcription failed at {int(offset)}s: {str(e)}")
+        _record_chunk_metrics(duration, elapsed)
+        return offset, span, segments
+
+    try:
+        for offset, audio, span in chunks:
+            # A chunk without audio only carries progress (e.g. trailing silence)
+            future = pool.submit(_transcribe_chunk, offset, audio) if len(audio) else None
+            pending.append((offset, span, len(audio) / SAMPLE_RATE, future))
+            if len(pending) >= in_flight:
+                yield collect()
+        while pending:
+            yield collect()
+    except BrokenProcessPool as e:
+        _discard_broken_pool(pool)
+        raise ChunkTranscriptionError(f"A whisper worker died: {e}")
+    finally:
+        for _, _, _, future in pending:
+            if future is not None:
+                future.cancel()
 
 def transcribe_video(video_path):
-    model = get_whisper_model()
-    
-    if model is None:
+    if not whisper_available():
         return {"error": "Whisper not installed. Run: pip install openai-whisper"}
     
     if not os.path.exists(video_path):
         return {"error": "File not found"}
     
-    # Extract audio to temporary file to avoid piping issues
-    import tempfile
-    import shutil
-    
-    temp_audio = os.path.join(tempfile.gettempdir(), f"temp_audio_{os.getpid()}.wav")
-    
     try:
         # Check ffmpeg availability again
         if not setup_ffmpeg():
             return {"error": "FFmpeg not found. Please install FFmpeg."}
-            
-        # Extract audio using ffmpeg directly
-        # -y: overwrite, -vn: no video, -acodec pcm_s16le: wav format, -ar 16000: 16k sample rate (whisper expects this)
-        cmd = [
-            'ffmpeg', '-y', 
-            '-i', video_path, 
-            '-vn', 
-            '-acodec', 'pcm_s16le', 
-            '-ar', '16000', 
-            '-ac', '1', 
-            temp_audio
-        ]
         
-        # specific for windows to hide console window
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            
-        subprocess.run(cmd, check=True, capture_output=True, startupinfo=startupinfo)
-        
-        if not os.path.exists(temp_audio):
-           return {"error": "Failed to extract audio from video"}
-
-        # Transcribe the temp audio file
-        result = model.transcribe(temp_audio)
+        # Decode audio straight into memory and hand the array to whisper
+        audio = load_audio(video_path)
+        if audio.size == 0:
+            return {"error": "Failed to extract audio from video"}
         
-        segments = []
-        for seg in result.get("segments", []):
-            segments.append({
-                "start": seg["start"],
-                "end": seg["end"],
-                "text": seg["text"].strip()
-            })
+        # The model lives in a whisper worker, like for streaming jobs
+        pool, _ = acquire_transcription_pool(DEFAULT_WORKERS)
+        try:
+            text, segments = pool.submit(_transcribe_audio, audio).result()
+        except BrokenProcessPool:
+            _discard_broken_pool(pool)
+            raise
+        finally:
+            release_transcription_pool(pool)
         
         return {
-            "text": result.get("text", ""),
+            "text": text,
             "segments": segments
         }
         
@@ -115,59 +361,64 @@ def transcribe_video(video_path):
         return {"error": f"FFmpeg failed: {e.stderr.decode() if e.stderr else str(e)}"}
     except Exception as e:
         return {"error": f"Transcription failed: {str(e)}"}
-    finally:
-        # Cleanup
-        if os.path.exists(temp_audio):
-            try:
-                os.remove(temp_audio)
-            except:
-                pass
 
 
 def get_video_duration(video_path):
     """Get video duration in seconds using ffprobe"""
     try:
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
         cmd = [
             'ffprobe', '-v', 'error',
             '-show_entries', 'format=duration',
             '-of', 'default=noprint_wrappers=1:nokey=1',
             video_path
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, startupinfo=startupinfo)
+        result = subprocess.run(cmd, capture_output=True, text=True, startupinfo=_startupinfo())
         return float(result.stdout.strip())
     except:
         return None
 
 
-def transcribe_video_streaming(video_path, chunk_duration=20):
+def transcribe_video_streaming(video_path, chunk_duration=20, persist=False,
+                               workers=DEFAULT_WORKERS, playback_position=0.0, max_memory_mb=None,
+                               vad=True, should_stop=None):
     """
     Streaming transcription that yields segments progressively.
     
     Instead of transcribing the entire video at once, this function:
-    1. Splits audio into chunks (default 20 seconds each for fast response)
-    2. Transcribes each chunk immediately  
-    3. Yields segments as they're ready
+    1. Decodes the soundtrack once with a single ffmpeg process into 16 kHz PCM
+    2. Cuts the PCM into chunks (default 20 seconds each for fast response)
+    3. Transcribes each chunk array immediately and yields its segments
     
     This allows subtitles to appear within ~10-15 seconds (like YouTube)
     instead of waiting for the entire video to be transcribed.
     
+    Chunks are transcribed by a pool of worker processes, one whisper model
+    per worker, so concurrent jobs never share a model; with workers > 1
+    (capped by max_memory_mb) they run in parallel, and segments are still
+    yielded in order. The chunk under playback_position is transcribed and
+    yielded first; every other chunk follows in timestamp order.
+    
+    With vad=True an energy-based voice activity pass drops non-speech and
+    places chunk boundaries in pauses (chunks are at most chunk_duration long).
+    
+    With persist=True segments are also written to the database in batches
+    as they are produced. They replace the previous transcript of the video
+    only once the whole video is transcribed; a cancelled or failed run
+    leaves the previous transcript in place.
+    
+    should_stop is polled between chunks; when it returns True transcription
+    stops and the decoder and pending chunks are released.
+    
     Yields:
         dict: Either a segment {"type": "segment", "data": {...}} 
               or status {"type": "progress", "percent": N, "message": "..."}
               or error {"type": "error", "error": "..."}
               or completion {"type": "complete"}
     """
-    import tempfile
     import json
     
-    model = get_whisper_model()
-    
-    if model is None:
+    workers = resolve_worker_count(workers, max_memory_mb)
+    if not whisper_available():
         yield json.dumps({"type": "error", "error": "Whisper not installed. Run: pip install openai-whisper"})
         return
     
@@ -179,94 +430,60 @@ def transcribe_video_streaming(video_path, chunk_duration=20):
         yield json.dumps({"type": "error", "error": "FFmpeg not found. Please install FFmpeg."})
         return
     
-    # Get total duration
-    total_duration = get_video_duration(video_path)
-    if not total_duration:
-        # Fallback: try normal transcription
-        yield json.dumps({"type": "progress", "percent": 0, "message": "Could not determine duration, using full transcription..."})
-        result = transcribe_video(video_path)
-        if "error" in result:
-            yield json.dumps({"type": "error", "error": result["error"]})
-        else:
-            for seg in result.get("segments", []):
-                yield json.dumps({"type": "segment", "data": seg})
-            yield json.dumps({"type": "complete"})
-        return
-    
-    yield json.dumps({"type": "progress", "percent": 0, "message": f"Starting transcription ({int(total_duration)}s video)..."})
+    # Persist segments server-side as they are produced
+    writer = None
+    if persist:
+        from database import TranscriptWriter
+        writer = TranscriptWriter(video_path)
     
-    # Process in chunks
-    temp_dir = tempfile.gettempdir()
-    current_time = 0
-    all_segments = []
+    # Total duration is only used for progress reporting
+    total_duration = get_video_duration(video_path)
+    if total_duration:
+        yield json.dumps({"type": "progress", "percent": 0, "message": f"Starting transcription ({int(total_duration)}s video)..."})
+    else:
+        yield json.dumps({"type": "progress", "percent": 0, "message": "Starting transcription..."})
     
-    startupinfo = None
-    if os.name == 'nt':
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    blocks = iter_scheduled_chunks(video_path, chunk_duration, playback_position)
+    if vad:
+        from vad import SpeechChunker
+        chunks = SpeechChunker(max_chunk=chunk_duration).chunks(blocks)
+    else:
+        chunks = ((offset, audio, len(audio) / SAMPLE_RATE) for offset, audio in blocks)
+    pool, pool_workers = acquire_transcription_pool(workers)
+    results = _transcribe_parallel(pool, chunks, pool_workers * 2)
     
+    total_segments = 0
+    transcribed = 0.0
     try:
-        while current_time < total_duration:
-            chunk_end = min(current_time + chunk_duration, total_duration)
-            chunk_file = os.path.join(temp_dir, f"chunk_{os.getpid()}_{int(current_time)}.wav")
-            
-            # Extract audio chunk
-            cmd = [
-                'ffmpeg', '-y',
-                '-ss', str(current_time),
-                '-t', str(chunk_duration),
-                '-i', video_path,
-                '-vn',
-                '-acodec', 'pcm_s16le',
-                '-ar', '16000',
-                '-ac', '1',
-                chunk_file
-            ]
-            
-            try:
-                subprocess.run(cmd, check=True, capture_output=True, startupinfo=startupinfo)
-            except subprocess.CalledProcessError as e:
-                yield json.dumps({"type": "error", "error": f"FFmpeg chunk extraction failed: {str(e)}"})
-                return
-            
-            if not os.path.exists(chunk_file):
-                yield json.dumps({"type": "error", "error": f"Failed to extract chunk at {current_time}s"})
+        for _, span, segments in results:
+            if should_stop is not None and should_stop():
                 return
-            
-            # Transcribe this chunk
-            try:
-                result = model.transcribe(chunk_file)
-                
-                # Adjust timestamps by adding current_time offset
-                for seg in result.get("segments", []):
-                    adjusted_segment = {
-                        "start": seg["start"] + current_time,
-                        "end": seg["end"] + current_time,
-                        "text": seg["text"].strip()
-                    }
-                    all_segments.append(adjusted_segment)
-                    # Yield each segment immediately for real-time subtitles
-                    yield json.dumps({"type": "segment", "data": adjusted_segment})
-                
-            except Exception as e:
-                yield json.dumps({"type": "error", "error": f"Transcription failed at {current_time}s: {str(e)}"})
-                return
-            finally:
-                # Cleanup chunk file
-                if os.path.exists(chunk_file):
-                    try:
-                        os.remove(chunk_file)
-                    except:
-                        pass
+            for segment in segments:
+                total_segments += 1
+                if writer is not None:
+                    writer.add(segment)
+                # Yield each segment immediately for real-time subtitles
+                yield json.dumps({"type": "segment", "data": segment})
             
             # Update progress
-            percent = int((chunk_end / total_duration) * 100)
-            yield json.dumps({"type": "progress", "percent": percent, "message": f"Transcribed {int(chunk_end)}s / {int(total_duration)}s"})
-            
-            current_time = chunk_end
+            transcribed += span
+            if total_duration:
+                percent = min(100, int((transcribed / total_duration) * 100))
+                yield json.dumps({"type": "progress", "percent": percent, "message": f"Transcribed {int(transcribed)}s / {int(total_duration)}s"})
+            else:
+                yield json.dumps({"type": "progress", "percent": 0, "message": f"Transcribed {int(transcribed)}s"})
         
         # All done
-        yield json.dumps({"type": "complete", "total_segments": len(all_segments)})
+        if writer is not None:
+            writer.commit()
+        yield json.dumps({"type": "complete", "total_segments": total_segments})
         
+    except ChunkTranscriptionError as e:
+        yield json.dumps({"type": "error", "error": str(e)})
     except Exception as e:
         yield json.dumps({"type": "error", "error": f"Streaming transcription failed: {str(e)}"})
+    finally:
+        results.close()
+        release_transcription_pool(pool)
+        if writer is not None:
+            writer.close()
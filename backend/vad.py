@@ -0,0 +1,149 @@
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+
+
+def frame_energy_db(audio, frame_length):
+    """RMS energy in dBFS of consecutive non-overlapping frames"""
+    count = len(audio) // frame_length
+    if count == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = audio[:count * frame_length].reshape(count, frame_length)
+    rms = np.sqrt(np.mean(frames * frames, axis=1) + 1e-12)
+    return 20 * np.log10(rms)
+
+
+def _runs(mask):
+    """(start, end) index pairs of the True runs in a boolean array"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+class SpeechChunker:
+    """Energy-based voice activity pre-pass that cuts PCM into speech chunks.
+
+    Non-speech stretches (silence, quiet beds) are dropped and chunk
+    boundaries are placed in pauses instead of at fixed offsets. Every chunk
+    is a contiguous slice of the original audio, so its offset maps its
+    timestamps exactly back to the source timeline.
+    """
+
+    def __init__(self, max_chunk=20.0, min_pause=0.3, min_speech=0.25, padding=0.2,
+                 long_silence=2.0, margin_db=12.0, min_db=-50.0, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.frame_length = int(FRAME_SECONDS * sample_rate)
+        self.max_chunk = int(max_chunk * sample_rate)
+        self.min_pause_frames = max(1, int(min_pause / FRAME_SECONDS))
+        self.min_speech_frames = max(1, int(min_speech / FRAME_SECONDS))
+        self.padding = int(padding * sample_rate)
+        self.long_silence = int(long_silence * sample_rate)
+        # Audio this close to the end of the buffer may still belong to a growing region
+        self.guard = int((min_pause + padding) * sample_rate) + self.frame_length
+        self.margin_db = margin_db
+        self.min_db = min_db
+        self.noise_floor = None
+
+    def chunks(self, blocks):
+        """Turn (offset, audio) blocks into (offset, audio, span) speech chunks.
+
+        span is how much of the source timeline the chunk accounts for,
+        including the non-speech dropped before it, for progress reporting.
+        Non-speech at the end of the audio comes out as a chunk without
+        audio, so the spans always add up to the whole timeline.
+        A gap in the incoming offsets (e.g. a wrap-around) flushes the buffer.
+        """
+        self.buffer = np.empty(0, dtype=np.float32)
+        self.start = None
+        for offset, audio in blocks:
+            if self.start is not None:
+                expected = self.start + len(self.buffer) / self.sample_rate
+                if abs(offset - expected) > 2.0 / self.sample_rate:
+                    yield from self._drain(final=True)
+                    self.start = None
+            if self.start is None:
+                self.start = offset
+                self.accounted = offset
+                self.buffer = np.empty(0, dtype=np.float32)
+            self.buffer = np.concatenate((self.buffer, audio))
+            yield from self._drain(final=False)
+        if self.start is not None:
+            yield from self._drain(final=True)
+
+    def _speech_regions(self):
+        """Padded (start, end) sample ranges of speech in the current buffer"""
+        energy = frame_energy_db(self.buffer, self.frame_length)
+        if energy.size == 0:
+            return energy, []
+
+        floor, peak = np.percentile(energy, [10, 90])
+        # A buffer without any level contrast says nothing about the noise floor
+        if peak - floor >= self.margin_db:
+            if self.noise_floor is None or floor < self.noise_floor:
+                self.noise_floor = float(floor)
+            else:
+                # Let the floor drift up slowly when the noise level rises
+                self.noise_floor += 0.5
+        threshold = self.min_db
+        if self.noise_floor is not None:
+            threshold = max(self.noise_floor + self.margin_db, self.min_db)
+
+        mask = energy > threshold
+        # Short pauses are part of the speech around them
+        for start, end in _runs(~mask):
+            if start > 0 and end < len(mask) and end - start < self.min_pause_frames:
+                mask[start:end] = True
+        regions = []
+        for start, end in _runs(mask):
+            if end - start >= self.min_speech_frames:
+                regions.append((
+                    max(0, start * self.frame_length - self.padding),
+                    min(len(self.buffer), end * self.frame_length + self.padding)
+                ))
+        return energy, regions
+
+    def _emit(self, start, end):
+        offset = self.start + start / self.sample_rate
+        chunk_end = self.start + end / self.sample_rate
+        span = chunk_end - self.accounted
+        self.accounted = chunk_end
+        return offset, self.buffer[start:end].copy(), span
+
+    def _advance(self, samples):
+        self.buffer = self.buffer[samples:]
+        self.start += samples / self.sample_rate
+
+    def _drain(self, final):
+        while len(self.buffer):
+            if not final and len(self.buffer) < self.max_chunk + self.guard:
+                return
+
+            energy, regions = self._speech_regions()
+            if not regions:
+                if final:
+                    self._advance(len(self.buffer))
+                    break
+                self._advance(max(0, len(self.buffer) - self.guard))
+                return
+
+            start, end = regions[0]
+            for next_start, next_end in regions[1:]:
+                if next_start - end >= self.long_silence or next_end - start > self.max_chunk:
+                    break
+                end = next_end
+
+            if end - start > self.max_chunk:
+                # One long stretch of speech: cut at the quietest frame near the limit
+                first = (start + self.max_chunk // 2) // self.frame_length
+                last = (start + self.max_chunk) // self.frame_length
+                end = (first + int(np.argmin(energy[first:last]))) * self.frame_length
+            elif not final and end > len(self.buffer) - self.guard:
+                # The chunk may still grow; drop the non-speech before it and wait
+                self._advance(start)
+                return
+
+            yield self._emit(start, end)
+            self._advance(end)
+
+        if final and self.start > self.accounted:
+            yield self._emit(0, 0)
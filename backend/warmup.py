@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+
+# Set NEURALPLAY_WARMUP=0 to load models only when a request first needs them
+WARMUP_ENABLED = os.environ.get("NEURALPLAY_WARMUP", "1") != "0"
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+UNAVAILABLE = "unavailable"
+FAILED = "failed"
+
+
+class ModelWarmup:
+    """Loads models in a background thread after startup and tracks their state.
+
+    Each loader is one of the lazy get_* functions of the detector modules,
+    which cache the model in a module global, so a model loaded here is the
+    one later requests use. A loader returning None means the model's
+    package is missing or its weights could not be loaded.
+    """
+
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self.lock = threading.Lock()
+        self.models = {name: {"state": PENDING, "seconds": None, "error": None} for name in loaders}
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        for name, loader in self.loaders.items():
+            with self.lock:
+                self.models[name]["state"] = LOADING
+            started = time.perf_counter()
+            try:
+                state = READY if loader() is not None else UNAVAILABLE
+                error = None
+            except Exception as e:
+                state, error = FAILED, str(e)
+                print(f"[Warmup] Failed to load {name}: {e}")
+            with self.lock:
+                self.models[name].update(state=state, error=error,
+                                         seconds=round(time.perf_counter() - started, 2))
+        print("[Warmup] Model warm-up finished")
+
+    def status(self):
+        with self.lock:
+            models = {name: dict(info) for name, info in self.models.items()}
+        return {
+            "warmup": self.thread is not None,
+            # Without warm-up, pending models load on first use and do not block readiness
+            "ready": all(info["state"] != LOADING and (info["state"] != PENDING or self.thread is None)
+                         for info in models.values()),
+            "models": models
+        }
@@ -257,16 +257,10 @@ function App() {
                             break;
 
                         case 'complete':
-                            // Store final transcript to database
+                            // The backend persists segments as they are produced
                             const finalTranscript = { segments: [...segments], text: segments.map(s => s.text).join(' ') };
                             setTranscript(finalTranscript);
 
-                            await fetch('http://localhost:8000/store_transcript?video_path=' + encodeURIComponent(realPath), {
-                                method: 'POST',
-                                headers: { 'Content-Type': 'application/json' },
-                                body: JSON.stringify(finalTranscript)
-                            });
-
                             setTranscriptionProgress("Transcription complete!");
                             setTimeout(() => setTranscriptionProgress(""), 2000);
                             eventSource.close();